@@ -5,12 +5,23 @@
 #include <stdint.h>
 #include <assert.h>
 
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#include <immintrin.h>
+#define FF8_REGION_X86
+#endif
+
 #define FF_SIZE          8
 #define FF_PRIM_POLY     0x1b
 #define FF_GENERATOR     0x03
 #define FF_ELEM_NUM      (2<<(FF_SIZE-1))
 #define FF_ELEM_MASK     (FF_ELEM_NUM-1)
 
+#define FF8_REGION_PORTABLE     0
+#define FF8_REGION_SSSE3        1
+#define FF8_REGION_AVX2         2
+
+int ff8_region_select(int level);
+
 /******************************************************************************/
 
 uint8_t ff8_exp_table[FF_ELEM_NUM];
@@ -18,6 +29,9 @@ uint8_t ff8_log_table[FF_ELEM_NUM];
 uint8_t ff8_sqrt_table[FF_ELEM_NUM];
 uint8_t ff8_mul_table[FF_ELEM_NUM][FF_ELEM_NUM];
 uint8_t ff8_div_table[FF_ELEM_NUM][FF_ELEM_NUM];
+/* Split nibble multiplication tables, c * x for the low and high nibble of x */
+uint8_t ff8_mul_lo_table[FF_ELEM_NUM][16];
+uint8_t ff8_mul_hi_table[FF_ELEM_NUM][16];
 
 /******************************************************************************/
 
@@ -106,6 +120,17 @@ void ff8_precompute(void) {
     for (i = 0; i < FF_ELEM_NUM; i++)
         for (j = 1; j < FF_ELEM_NUM; j++)
             ff8_div_table[i][j] = ff8_exp_div(i, j);
+
+    /* Precompute split nibble multiplication tables */
+    for (i = 0; i < FF_ELEM_NUM; i++) {
+        for (j = 0; j < 16; j++) {
+            ff8_mul_lo_table[i][j] = ff8_mul_table[i][j];
+            ff8_mul_hi_table[i][j] = ff8_mul_table[i][j << 4];
+        }
+    }
+
+    /* Select the fastest region implementation for this CPU */
+    ff8_region_select(FF8_REGION_AVX2);
 }
 
 /******************************************************************************/
@@ -136,6 +161,163 @@ uint8_t ff8_sqrt(uint8_t a) {
 
 /******************************************************************************/
 
+/* Region operations over rows of field elements. The vectorized versions
+ * multiply 16 or 32 elements at once by looking up the low and high nibble
+ * of each element in the split nibble tables with a byte shuffle, since
+ * c * x = c * (x & 0x0f) + c * (x & 0xf0). */
+
+/* dst = src .* c */
+static void ff8_region_mul_portable(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    const uint8_t *table = ff8_mul_table[c];
+    int i;
+    for (i = 0; i < n; i++)
+        dst[i] = table[src[i]];
+}
+
+/* dst = dst - (src .* c) */
+static void ff8_region_submul_portable(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    const uint8_t *table = ff8_mul_table[c];
+    int i;
+    for (i = 0; i < n; i++)
+        dst[i] ^= table[src[i]];
+}
+
+#ifdef FF8_REGION_X86
+
+__attribute__((target("ssse3")))
+static void ff8_region_mul_ssse3(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    __m128i lo = _mm_loadu_si128((const __m128i *)ff8_mul_lo_table[c]);
+    __m128i hi = _mm_loadu_si128((const __m128i *)ff8_mul_hi_table[c]);
+    __m128i mask = _mm_set1_epi8(0x0f);
+    int i;
+
+    for (i = 0; i + 16 <= n; i += 16) {
+        __m128i x = _mm_loadu_si128((const __m128i *)&src[i]);
+        __m128i pl = _mm_shuffle_epi8(lo, _mm_and_si128(x, mask));
+        __m128i ph = _mm_shuffle_epi8(hi, _mm_and_si128(_mm_srli_epi64(x, 4), mask));
+        _mm_storeu_si128((__m128i *)&dst[i], _mm_xor_si128(pl, ph));
+    }
+
+    ff8_region_mul_portable(&dst[i], &src[i], c, n - i);
+}
+
+__attribute__((target("ssse3")))
+static void ff8_region_submul_ssse3(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    __m128i lo = _mm_loadu_si128((const __m128i *)ff8_mul_lo_table[c]);
+    __m128i hi = _mm_loadu_si128((const __m128i *)ff8_mul_hi_table[c]);
+    __m128i mask = _mm_set1_epi8(0x0f);
+    int i;
+
+    for (i = 0; i + 16 <= n; i += 16) {
+        __m128i x = _mm_loadu_si128((const __m128i *)&src[i]);
+        __m128i d = _mm_loadu_si128((const __m128i *)&dst[i]);
+        __m128i pl = _mm_shuffle_epi8(lo, _mm_and_si128(x, mask));
+        __m128i ph = _mm_shuffle_epi8(hi, _mm_and_si128(_mm_srli_epi64(x, 4), mask));
+        _mm_storeu_si128((__m128i *)&dst[i], _mm_xor_si128(d, _mm_xor_si128(pl, ph)));
+    }
+
+    ff8_region_submul_portable(&dst[i], &src[i], c, n - i);
+}
+
+__attribute__((target("avx2")))
+static void ff8_region_mul_avx2(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    __m256i lo = _mm256_broadcastsi128_si256(_mm_loadu_si128((const __m128i *)ff8_mul_lo_table[c]));
+    __m256i hi = _mm256_broadcastsi128_si256(_mm_loadu_si128((const __m128i *)ff8_mul_hi_table[c]));
+    __m256i mask = _mm256_set1_epi8(0x0f);
+    int i;
+
+    for (i = 0; i + 32 <= n; i += 32) {
+        __m256i x = _mm256_loadu_si256((const __m256i *)&src[i]);
+        __m256i pl = _mm256_shuffle_epi8(lo, _mm256_and_si256(x, mask));
+        __m256i ph = _mm256_shuffle_epi8(hi, _mm256_and_si256(_mm256_srli_epi64(x, 4), mask));
+        _mm256_storeu_si256((__m256i *)&dst[i], _mm256_xor_si256(pl, ph));
+    }
+
+    ff8_region_mul_portable(&dst[i], &src[i], c, n - i);
+}
+
+__attribute__((target("avx2")))
+static void ff8_region_submul_avx2(uint8_t *dst, const uint8_t *src, uint8_t c, int n) {
+    __m256i lo = _mm256_broadcastsi128_si256(_mm_loadu_si128((const __m128i *)ff8_mul_lo_table[c]));
+    __m256i hi = _mm256_broadcastsi128_si256(_mm_loadu_si128((const __m128i *)ff8_mul_hi_table[c]));
+    __m256i mask = _mm256_set1_epi8(0x0f);
+    int i;
+
+    for (i = 0; i + 32 <= n; i += 32) {
+        __m256i x = _mm256_loadu_si256((const __m256i *)&src[i]);
+        __m256i d = _mm256_loadu_si256((const __m256i *)&dst[i]);
+        __m256i pl = _mm256_shuffle_epi8(lo, _mm256_and_si256(x, mask));
+        __m256i ph = _mm256_shuffle_epi8(hi, _mm256_and_si256(_mm256_srli_epi64(x, 4), mask));
+        _mm256_storeu_si256((__m256i *)&dst[i], _mm256_xor_si256(d, _mm256_xor_si256(pl, ph)));
+    }
+
+    ff8_region_submul_portable(&dst[i], &src[i], c, n - i);
+}
+
+#endif
+
+void (*ff8_region_mul)(uint8_t *dst, const uint8_t *src, uint8_t c, int n) = ff8_region_mul_portable;
+void (*ff8_region_submul)(uint8_t *dst, const uint8_t *src, uint8_t c, int n) = ff8_region_submul_portable;
+
+/* Select the region implementation, falling back to the best one below
+ * level that the CPU supports. Returns the level selected. */
+int ff8_region_select(int level) {
+#ifdef FF8_REGION_X86
+    if (level >= FF8_REGION_AVX2 && __builtin_cpu_supports("avx2")) {
+        ff8_region_mul = ff8_region_mul_avx2;
+        ff8_region_submul = ff8_region_submul_avx2;
+        return FF8_REGION_AVX2;
+    }
+    if (level >= FF8_REGION_SSSE3 && __builtin_cpu_supports("ssse3")) {
+        ff8_region_mul = ff8_region_mul_ssse3;
+        ff8_region_submul = ff8_region_submul_ssse3;
+        return FF8_REGION_SSSE3;
+    }
+#endif
+    ff8_region_mul = ff8_region_mul_portable;
+    ff8_region_submul = ff8_region_submul_portable;
+    return FF8_REGION_PORTABLE;
+}
+
+void ff8_region_test(void) {
+    uint8_t src[100], dst[100], expected[100];
+    int lengths[] = {0, 1, 15, 16, 17, 31, 32, 33, 63, 64, 67, 93};
+    int level, c, i, k, n, offset;
+
+    for (level = FF8_REGION_PORTABLE; level <= FF8_REGION_AVX2; level++) {
+        if (ff8_region_select(level) != level)
+            continue;
+
+        for (c = 0; c < FF_ELEM_NUM; c++) {
+            /* Cover the vector bodies, the scalar tails, and unaligned rows */
+            for (k = 0; k < (int)(sizeof(lengths)/sizeof(lengths[0])); k++) {
+                n = lengths[k];
+                offset = c % 7;
+                for (i = 0; i < n + offset; i++) {
+                    src[i] = rand() % FF_ELEM_NUM;
+                    dst[i] = rand() % FF_ELEM_NUM;
+                }
+
+                /* Test region multiplication */
+                for (i = 0; i < n; i++)
+                    expected[i] = ff8_mul(src[offset+i], c);
+                ff8_region_mul(&dst[offset], &src[offset], c, n);
+                assert(memcmp(&dst[offset], expected, n) == 0);
+
+                /* Test region subtraction of a multiple */
+                for (i = 0; i < n; i++)
+                    expected[i] = ff8_sub(dst[offset+i], ff8_mul(src[offset+i], c));
+                ff8_region_submul(&dst[offset], &src[offset], c, n);
+                assert(memcmp(&dst[offset], expected, n) == 0);
+            }
+        }
+    }
+
+    ff8_region_select(FF8_REGION_AVX2);
+}
+
+/******************************************************************************/
+
 void ff8_test(void) {
     int a, b;
 
@@ -170,48 +352,44 @@ void ff8_test(void) {
 
 /******************************************************************************/
 
-#define MAX_ROWS    2048
-#define MAX_COLS    2048
-
 /* Matrix A is an array of pointers to rows, so we can do fast row swaps */
-uint8_t *matrix[MAX_ROWS];
-int matrix_rows, matrix_cols;
+typedef struct matrix {
+    uint8_t **rows;
+    int num_rows, num_cols;
+    /* Nonzero column extents [lo, hi) of each row, for sparse elimination */
+    int *row_lo, *row_hi;
+} matrix_t;
 
 /* matrix[i] <-> matrix[j] */
-void matrix_row_swap(int i, int j) {
+void matrix_row_swap(matrix_t *A, int i, int j) {
     uint8_t *temp;
-    temp = matrix[i];
-    matrix[i] = matrix[j];
-    matrix[j] = temp;
+    temp = A->rows[i];
+    A->rows[i] = A->rows[j];
+    A->rows[j] = temp;
 }
 
 /* matrix[i] = matrix[i] ./ c */
-void matrix_row_div(int i, uint8_t c) {
-    int j;
-    for (j = 0; j < matrix_cols; j++)
-        matrix[i][j] = ff8_div(matrix[i][j], c);
+void matrix_row_div(matrix_t *A, int i, uint8_t c) {
+    /* matrix[i] ./ c = matrix[i] .* (1/c) */
+    ff8_region_mul(A->rows[i], A->rows[i], ff8_div(1, c), A->num_cols);
 }
 
 /* matrix[i] = matrix[i] .* c */
-void matrix_row_mul(int i, uint8_t c) {
-    int j;
-    for (j = 0; j < matrix_cols; j++)
-        matrix[i][j] = ff8_mul(matrix[i][j], c);
+void matrix_row_mul(matrix_t *A, int i, uint8_t c) {
+    ff8_region_mul(A->rows[i], A->rows[i], c, A->num_cols);
 }
 
 /* matrix[i] = matrix[i] - (matrix[j] .* c) */
-void matrix_row_submul(int i, int j, uint8_t c) {
-    int k;
-    for (k = 0; k < matrix_cols; k++)
-        matrix[i][k] = ff8_sub(matrix[i][k], ff8_mul(matrix[j][k], c));
+void matrix_row_submul(matrix_t *A, int i, int j, uint8_t c) {
+    ff8_region_submul(A->rows[i], A->rows[j], c, A->num_cols);
 }
 
 /* Find solved index of matrix[r] row */
-int matrix_solved_index(int r) {
+int matrix_solved_index(matrix_t *A, int r) {
     int i, solved_index = -1;
 
-    for (i = 0; i < matrix_cols; i++) {
-        if (matrix[r][i] != 0) {
+    for (i = 0; i < A->num_cols; i++) {
+        if (A->rows[r][i] != 0) {
             if (solved_index != -1)
                 return -1;
             solved_index = i;
@@ -221,23 +399,23 @@ int matrix_solved_index(int r) {
     return solved_index;
 }
 
-void matrix_debug_dump(void) {
+void matrix_debug_dump(matrix_t *A) {
     int i, j;
 
-    for (j = 0; j < matrix_rows; j++) {
-        for (i = 0; i < matrix_cols; i++) {
-            printf("%d ", matrix[j][i]);
+    for (j = 0; j < A->num_rows; j++) {
+        for (i = 0; i < A->num_cols; i++) {
+            printf("%d ", A->rows[j][i]);
         }
         printf("\n");
     }
 }
 
-bool matrix_debug_compare(uint8_t *vector) {
+bool matrix_debug_compare(matrix_t *A, uint8_t *vector) {
     int i, j;
 
-    for (j = 0; j < matrix_rows; j++) {
-        for (i = 0; i < matrix_cols; i++) {
-            if (vector[j*matrix_cols + i] != matrix[j][i])
+    for (j = 0; j < A->num_rows; j++) {
+        for (i = 0; i < A->num_cols; i++) {
+            if (vector[j*A->num_cols + i] != A->rows[j][i])
                 return false;
         }
     }
@@ -245,30 +423,30 @@ bool matrix_debug_compare(uint8_t *vector) {
     return true;
 }
 
-void matrix_rref(void) {
+void matrix_rref(matrix_t *A) {
     int i, j, k, pi;
     bool done = false;
 
     /* Pivot index */
     pi = 0;
 
-    for (j = 0; j < matrix_rows; j++) {
+    for (j = 0; j < A->num_rows; j++) {
         /* While we do not have a pivot for this row */
-        while (matrix[j][pi] == 0) {
+        while (A->rows[j][pi] == 0) {
             /* Find a row below to swap with for a pivot at pi */
-            for (k = j+1; k < matrix_rows; k++) {
-                if (matrix[k][pi] != 0) {
-                    matrix_row_swap(j, k);
+            for (k = j+1; k < A->num_rows; k++) {
+                if (A->rows[k][pi] != 0) {
+                    matrix_row_swap(A, j, k);
                     break;
                 }
             }
 
             /* Increment pivot index, if we could not find a row to swap with */
-            if (matrix[j][pi] == 0)
+            if (A->rows[j][pi] == 0)
                 pi += 1;
 
             /* If there is no pivots left, we're done reducing */
-            if (pi == matrix_cols) {
+            if (pi == A->num_cols) {
                 done = true;
                 break;
             }
@@ -278,60 +456,394 @@ void matrix_rref(void) {
             break;
 
         /* Divide through to have a pivot of 1 */
-        matrix_row_div(j, matrix[j][pi]);
+        matrix_row_div(A, j, A->rows[j][pi]);
 
         /* Eliminate above and below */
-        for (k = 0; k < matrix_rows; k++) {
-            if (k != j && matrix[k][pi] != 0)
-                matrix_row_submul(k, j, matrix[k][pi]);
+        for (k = 0; k < A->num_rows; k++) {
+            if (k != j && A->rows[k][pi] != 0)
+                matrix_row_submul(A, k, j, A->rows[k][pi]);
         }
 
         /* Move onto the next pivot */
         pi += 1;
 
         /* If there no pivots left, we're done, reducing */
-        if (pi == matrix_cols)
+        if (pi == A->num_cols)
             break;
     }
 }
 
 /******************************************************************************/
 
-void matrix_util_clear(uint16_t *solved_indices, uint8_t *flat_matrix, int m, int n) {
-    assert(m <= MAX_ROWS);
-    assert(n <= MAX_COLS);
+/* Sparse elimination keeps the nonzero column extent [lo, hi) of each row, so
+ * row operations only touch the columns that can be nonzero. Once the rows
+ * fill in past MATRIX_SPARSE_FILL_MAX percent of the matrix, the extents are
+ * widened to the full row and elimination continues densely. */
+
+#define MATRIX_SPARSE_FILL_MAX  50
+
+/* Recompute the nonzero extent of matrix[i] */
+void matrix_row_extent(matrix_t *A, int i) {
+    int lo, hi;
+
+    for (lo = 0; lo < A->num_cols && A->rows[i][lo] == 0; lo++)
+        ;
+    for (hi = A->num_cols; hi > lo && A->rows[i][hi-1] == 0; hi--)
+        ;
+
+    A->row_lo[i] = lo;
+    A->row_hi[i] = hi;
+}
+
+/* matrix[i] <-> matrix[j], with extents */
+void matrix_row_swap_sparse(matrix_t *A, int i, int j) {
+    int temp;
+
+    matrix_row_swap(A, i, j);
+
+    temp = A->row_lo[i];
+    A->row_lo[i] = A->row_lo[j];
+    A->row_lo[j] = temp;
+
+    temp = A->row_hi[i];
+    A->row_hi[i] = A->row_hi[j];
+    A->row_hi[j] = temp;
+}
+
+/* matrix[i] = matrix[i] - (matrix[j] .* c), over the extent of matrix[j] */
+void matrix_row_submul_sparse(matrix_t *A, int i, int j, uint8_t c) {
+    int lo = A->row_lo[j], hi = A->row_hi[j];
+
+    ff8_region_submul(&A->rows[i][lo], &A->rows[j][lo], c, hi - lo);
+
+    if (lo < A->row_lo[i])
+        A->row_lo[i] = lo;
+    if (hi > A->row_hi[i])
+        A->row_hi[i] = hi;
+}
+
+/* Nonzero test of matrix[i][j] that skips columns outside the extent */
+#define MATRIX_SPARSE_NONZERO(A, i, j) \
+    ((j) >= (A)->row_lo[i] && (j) < (A)->row_hi[i] && (A)->rows[i][j] != 0)
+
+void matrix_rref_sparse(matrix_t *A) {
+    int j, k, pi, fill;
+    bool dense = false;
+
+    if (A->num_rows == 0 || A->num_cols == 0)
+        return;
+
+    /* Compute initial extents */
+    fill = 0;
+    for (j = 0; j < A->num_rows; j++) {
+        matrix_row_extent(A, j);
+        fill += A->row_hi[j] - A->row_lo[j];
+    }
+
+    /* Pivot index */
+    pi = 0;
+
+    for (j = 0; j < A->num_rows; j++) {
+        /* Fall back to dense rows if fill-in got high */
+        if (!dense && fill > (MATRIX_SPARSE_FILL_MAX * A->num_rows / 100) * A->num_cols) {
+            for (k = 0; k < A->num_rows; k++) {
+                A->row_lo[k] = 0;
+                A->row_hi[k] = A->num_cols;
+            }
+            dense = true;
+        }
+
+        /* While we do not have a pivot for this row */
+        while (!MATRIX_SPARSE_NONZERO(A, j, pi)) {
+            /* Find a row below to swap with for a pivot at pi */
+            for (k = j+1; k < A->num_rows; k++) {
+                if (MATRIX_SPARSE_NONZERO(A, k, pi)) {
+                    matrix_row_swap_sparse(A, j, k);
+                    break;
+                }
+            }
+
+            /* Increment pivot index, if we could not find a row to swap with */
+            if (!MATRIX_SPARSE_NONZERO(A, j, pi))
+                pi += 1;
+
+            /* If there is no pivots left, we're done reducing */
+            if (pi == A->num_cols)
+                return;
+        }
+
+        /* Divide through to have a pivot of 1, columns before the pivot are
+         * already zero */
+        A->row_lo[j] = pi;
+        ff8_region_mul(&A->rows[j][pi], &A->rows[j][pi], ff8_div(1, A->rows[j][pi]),
+                       A->row_hi[j] - pi);
+
+        /* Eliminate above and below */
+        for (k = 0; k < A->num_rows; k++) {
+            if (k != j && MATRIX_SPARSE_NONZERO(A, k, pi)) {
+                fill -= A->row_hi[k] - A->row_lo[k];
+                matrix_row_submul_sparse(A, k, j, A->rows[k][pi]);
+                fill += A->row_hi[k] - A->row_lo[k];
+            }
+        }
+
+        /* Move onto the next pivot */
+        pi += 1;
+
+        /* If there no pivots left, we're done, reducing */
+        if (pi == A->num_cols)
+            break;
+    }
+}
+
+/******************************************************************************/
+
+/* Allocate the row buffers of A for m rows, returns false on failure */
+static bool matrix_alloc_rows(matrix_t *A, int m) {
+    size_t count = m > 0 ? m : 1;
+
+    A->rows = malloc(sizeof(uint8_t *)*count);
+    A->row_lo = malloc(sizeof(int)*count);
+    A->row_hi = malloc(sizeof(int)*count);
+
+    return A->rows != NULL && A->row_lo != NULL && A->row_hi != NULL;
+}
+
+static void matrix_free_rows(matrix_t *A) {
+    free(A->rows);
+    free(A->row_lo);
+    free(A->row_hi);
+}
+
+/* Load the rows of a flat m x n matrix below its first num_identity rows into
+ * A without the identity columns, and reduce them with sparse elimination */
+static void matrix_reduce_identity(matrix_t *A, uint8_t *flat_matrix, int m, int n, int num_identity) {
+    int j;
 
+    assert(num_identity <= m && num_identity <= n);
+
+    A->num_rows = m - num_identity;
+    A->num_cols = n - num_identity;
+
+    /* Load the remaining rows without the identity columns */
+    for (j = 0; j < A->num_rows; j++) {
+        A->rows[j] = &flat_matrix[(size_t)(j + num_identity)*n];
+        memmove(A->rows[j], A->rows[j] + num_identity, A->num_cols);
+    }
+
+    /* Do the rref */
+    matrix_rref_sparse(A);
+}
+
+void matrix_util_clear(uint16_t *solved_indices, uint8_t *flat_matrix, int m, int n) {
     memset(solved_indices, 0, sizeof(uint16_t)*n);
     memset(flat_matrix, 0, sizeof(uint8_t)*m*n);
 }
 
 int matrix_solve(uint16_t *solved_indices, uint8_t *flat_matrix, int m, int n) {
+    matrix_t A;
     int i, j, num_solved;
 
-    matrix_rows = m;
-    matrix_cols = n;
+    if (!matrix_alloc_rows(&A, m)) {
+        matrix_free_rows(&A);
+        return -1;
+    }
 
-    assert(matrix_rows <= MAX_ROWS);
-    assert(matrix_cols <= MAX_COLS);
+    A.num_rows = m;
+    A.num_cols = n;
 
     /* Load the matrix */
-    for (j = 0; j < matrix_rows; j++)
-        matrix[j] = &flat_matrix[j*n];
+    for (j = 0; j < A.num_rows; j++)
+        A.rows[j] = &flat_matrix[(size_t)j*n];
 
     /* Do the rref */
-    matrix_rref();
+    matrix_rref(&A);
 
     /* Find the count and indices of solved columns */
     num_solved = 0;
-    for (j = 0; j < matrix_rows; j++) {
-        if ((i = matrix_solved_index(j)) != -1)
+    for (j = 0; j < A.num_rows; j++) {
+        if ((i = matrix_solved_index(&A, j)) != -1)
             solved_indices[num_solved++] = i;
     }
 
+    matrix_free_rows(&A);
+
+    /* Return count of solved columns */
+    return num_solved;
+}
+
+/* Solve a matrix whose first num_identity rows are the identity over the
+ * first num_identity columns, as built for the decoded messages. The identity
+ * rows are not read: they are pre-eliminated by dropping their columns from
+ * the remaining rows, which are then reduced with sparse elimination. The
+ * solved indices match matrix_solve(), but the flat matrix is left holding
+ * the reduced remaining rows over the remaining columns. */
+int matrix_solve_sparse(uint16_t *solved_indices, uint8_t *flat_matrix, int m, int n, int num_identity) {
+    matrix_t A;
+    int i, j, num_solved;
+
+    if (!matrix_alloc_rows(&A, m - num_identity)) {
+        matrix_free_rows(&A);
+        return -1;
+    }
+
+    matrix_reduce_identity(&A, flat_matrix, m, n, num_identity);
+
+    /* The identity columns are solved, followed by the solved columns of the
+     * remaining rows */
+    num_solved = 0;
+    for (i = 0; i < num_identity; i++)
+        solved_indices[num_solved++] = i;
+    for (j = 0; j < A.num_rows; j++) {
+        if ((i = matrix_solved_index(&A, j)) != -1)
+            solved_indices[num_solved++] = i + num_identity;
+    }
+
+    matrix_free_rows(&A);
+
+    /* Return count of solved columns */
+    return num_solved;
+}
+
+/******************************************************************************/
+
+/* A solver context owns its matrix buffers, which grow on demand to the size
+ * of the matrices loaded, and holds no global state, so separate contexts can
+ * solve at the same time from different threads. */
+
+typedef struct matrix_ctx {
+    matrix_t A;
+    /* Flat row-major matrix buffer */
+    uint8_t *flat_matrix;
+    /* Dimensions of the loaded matrix */
+    int m, n;
+    /* Capacity of the row buffers and flat matrix buffer */
+    size_t max_rows, max_size;
+} matrix_ctx_t;
+
+matrix_ctx_t *matrix_ctx_alloc(void) {
+    return calloc(1, sizeof(matrix_ctx_t));
+}
+
+void matrix_ctx_free(matrix_ctx_t *ctx) {
+    if (ctx == NULL)
+        return;
+
+    matrix_free_rows(&ctx->A);
+    free(ctx->flat_matrix);
+    free(ctx);
+}
+
+/* Grow the context buffers to hold an m x n matrix, returns false on failure */
+static bool matrix_ctx_reserve(matrix_ctx_t *ctx, int m, int n) {
+    size_t size = (size_t)m*n;
+    void *p;
+
+    if ((size_t)m > ctx->max_rows) {
+        if ((p = realloc(ctx->A.rows, sizeof(uint8_t *)*m)) == NULL)
+            return false;
+        ctx->A.rows = p;
+        if ((p = realloc(ctx->A.row_lo, sizeof(int)*m)) == NULL)
+            return false;
+        ctx->A.row_lo = p;
+        if ((p = realloc(ctx->A.row_hi, sizeof(int)*m)) == NULL)
+            return false;
+        ctx->A.row_hi = p;
+        ctx->max_rows = m;
+    }
+
+    if (size > ctx->max_size) {
+        if ((p = realloc(ctx->flat_matrix, size)) == NULL)
+            return false;
+        ctx->flat_matrix = p;
+        ctx->max_size = size;
+    }
+
+    return true;
+}
+
+/* Size and clear the context for an m x n matrix, returns its flat row-major
+ * buffer to fill in, or NULL on allocation failure */
+uint8_t *matrix_ctx_load(matrix_ctx_t *ctx, int m, int n) {
+    assert(m >= 0 && n >= 0);
+
+    if (!matrix_ctx_reserve(ctx, m, n))
+        return NULL;
+
+    ctx->m = m;
+    ctx->n = n;
+    if (ctx->flat_matrix != NULL)
+        memset(ctx->flat_matrix, 0, (size_t)m*n);
+
+    return ctx->flat_matrix;
+}
+
+/* Solve the loaded matrix, whose first num_identity rows are the identity
+ * over the first num_identity columns, like matrix_solve_sparse(). The solved
+ * indices buffer must hold n entries. Returns the count of solved columns. */
+int matrix_ctx_solve(matrix_ctx_t *ctx, uint32_t *solved_indices, int num_identity) {
+    int i, j, num_solved;
+
+    matrix_reduce_identity(&ctx->A, ctx->flat_matrix, ctx->m, ctx->n, num_identity);
+
+    /* The identity columns are solved, followed by the solved columns of the
+     * remaining rows */
+    num_solved = 0;
+    for (i = 0; i < num_identity; i++)
+        solved_indices[num_solved++] = i;
+    for (j = 0; j < ctx->A.num_rows; j++) {
+        if ((i = matrix_solved_index(&ctx->A, j)) != -1)
+            solved_indices[num_solved++] = i + num_identity;
+    }
+
     /* Return count of solved columns */
     return num_solved;
 }
 
+/* Solve a batch of matrices described by their sparse rows, with one call.
+ * Matrix p is dims[3*p] x dims[3*p+1], and its first dims[3*p+2] rows are the
+ * identity, like matrix_ctx_solve(). Each of its remaining rows has row_nnz
+ * entries, taken in turn from the cols and coefs arrays across the whole
+ * batch. The solved indices of each matrix, including its identity columns,
+ * are written one matrix after another to solved_indices, which must hold
+ * the sum of the matrices' column counts, and their counts to num_solved.
+ * Returns the total count of solved columns, or -1 on allocation failure. */
+int matrix_ctx_solve_batch(matrix_ctx_t *ctx, int num_matrices, const int32_t *dims, const int32_t *row_nnz,
+                           const uint32_t *cols, const uint8_t *coefs, uint32_t *solved_indices, int32_t *num_solved) {
+    int p, j, k, total_solved = 0;
+
+    for (p = 0; p < num_matrices; p++) {
+        int m = dims[3*p], n = dims[3*p + 1], num_identity = dims[3*p + 2];
+
+        assert(m >= 0 && n >= 0 && num_identity <= m && num_identity <= n);
+
+        if (!matrix_ctx_reserve(ctx, m, n))
+            return -1;
+        ctx->m = m;
+        ctx->n = n;
+
+        /* Clear and fill in the rows below the identity, which is not read */
+        if (ctx->flat_matrix != NULL)
+            memset(ctx->flat_matrix + (size_t)num_identity*n, 0, (size_t)(m - num_identity)*n);
+        for (j = num_identity; j < m; j++) {
+            uint8_t *row = ctx->flat_matrix + (size_t)j*n;
+            for (k = 0; k < *row_nnz; k++) {
+                assert(cols[k] < (uint32_t)n);
+                row[cols[k]] = coefs[k];
+            }
+            cols += *row_nnz;
+            coefs += *row_nnz;
+            row_nnz++;
+        }
+
+        num_solved[p] = matrix_ctx_solve(ctx, solved_indices, num_identity);
+        solved_indices += num_solved[p];
+        total_solved += num_solved[p];
+    }
+
+    return total_solved;
+}
+
 int matrix_test_solve(uint16_t *solved, uint8_t *flat_matrix, int m, int n) {
     int i, j;
 
@@ -356,159 +868,161 @@ int matrix_test_solve(uint16_t *solved, uint8_t *flat_matrix, int m, int n) {
 #define MATRIX_STATIC_ROW(...) ((uint8_t *)(&(uint8_t []){ __VA_ARGS__ }))
 
 void matrix_test(void) {
+    uint8_t *rows[256];
+    matrix_t A = { rows, 0, 0, NULL, NULL };
     int i, j, k;
 
-    matrix_rows = 4;
-    matrix_cols = 5;
+    A.num_rows = 4;
+    A.num_cols = 5;
 
-    matrix[0] = MATRIX_STATIC_ROW(24, 21, 118, 193, 137);
-    matrix[1] = MATRIX_STATIC_ROW(76, 92, 70, 155, 167);
-    matrix[2] = MATRIX_STATIC_ROW(226, 249, 37, 53, 147);
-    matrix[3] = MATRIX_STATIC_ROW(120, 228, 148, 34, 32);
+    rows[0] = MATRIX_STATIC_ROW(24, 21, 118, 193, 137);
+    rows[1] = MATRIX_STATIC_ROW(76, 92, 70, 155, 167);
+    rows[2] = MATRIX_STATIC_ROW(226, 249, 37, 53, 147);
+    rows[3] = MATRIX_STATIC_ROW(120, 228, 148, 34, 32);
 
     /* Test row swap */
-    matrix_row_swap(0, 2);
-    assert(matrix[0][0] == 226);
-    assert(matrix[0][1] == 249);
-    assert(matrix[0][2] == 37);
-    assert(matrix[0][3] == 53);
-    assert(matrix[0][4] == 147);
-    assert(matrix[2][0] == 24);
-    assert(matrix[2][1] == 21);
-    assert(matrix[2][2] == 118);
-    assert(matrix[2][3] == 193);
-    assert(matrix[2][4] == 137);
+    matrix_row_swap(&A, 0, 2);
+    assert(rows[0][0] == 226);
+    assert(rows[0][1] == 249);
+    assert(rows[0][2] == 37);
+    assert(rows[0][3] == 53);
+    assert(rows[0][4] == 147);
+    assert(rows[2][0] == 24);
+    assert(rows[2][1] == 21);
+    assert(rows[2][2] == 118);
+    assert(rows[2][3] == 193);
+    assert(rows[2][4] == 137);
 
     /* Test row multiplication */
-    matrix_row_mul(1, 4);
-    assert(matrix[1][0] == 43);
-    assert(matrix[1][1] == 107);
-    assert(matrix[1][2] == 3);
-    assert(matrix[1][3] == 90);
-    assert(matrix[1][4] == 170);
+    matrix_row_mul(&A, 1, 4);
+    assert(rows[1][0] == 43);
+    assert(rows[1][1] == 107);
+    assert(rows[1][2] == 3);
+    assert(rows[1][3] == 90);
+    assert(rows[1][4] == 170);
 
     /* Test row division */
-    matrix_row_div(1, 4);
-    assert(matrix[1][0] == 76);
-    assert(matrix[1][1] == 92);
-    assert(matrix[1][2] == 70);
-    assert(matrix[1][3] == 155);
-    assert(matrix[1][4] == 167);
+    matrix_row_div(&A, 1, 4);
+    assert(rows[1][0] == 76);
+    assert(rows[1][1] == 92);
+    assert(rows[1][2] == 70);
+    assert(rows[1][3] == 155);
+    assert(rows[1][4] == 167);
 
     /* Test row subtraction of another row multiple */
-    matrix_row_submul(3, 0, 5);
-    assert(matrix[3][0] == 63);
-    assert(matrix[3][1] == 212);
-    assert(matrix[3][2] == 37);
-    assert(matrix[3][3] == 195);
-    assert(matrix[3][4] == 201);
+    matrix_row_submul(&A, 3, 0, 5);
+    assert(rows[3][0] == 63);
+    assert(rows[3][1] == 212);
+    assert(rows[3][2] == 37);
+    assert(rows[3][3] == 195);
+    assert(rows[3][4] == 201);
 
     /* Test rref */
     {
         uint8_t vector[] = {1, 0, 0, 0, 226, 0, 1, 0, 0, 190, 0, 0, 1, 0, 234, 0, 0, 0, 1, 37};
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
     }
 
-    matrix_rows = 3;
-    matrix_cols = 3;
+    A.num_rows = 3;
+    A.num_cols = 3;
 
     {
         uint8_t vector[] = {0, 0, 0, 0, 0, 0, 0, 0, 0};
-        matrix[0] = MATRIX_STATIC_ROW(0, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(0, 0, 0);
-        matrix[2] = MATRIX_STATIC_ROW(0, 0, 0);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == -1);
-        assert(matrix_solved_index(1) == -1);
-        assert(matrix_solved_index(2) == -1);
+        rows[0] = MATRIX_STATIC_ROW(0, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(0, 0, 0);
+        rows[2] = MATRIX_STATIC_ROW(0, 0, 0);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == -1);
+        assert(matrix_solved_index(&A, 1) == -1);
+        assert(matrix_solved_index(&A, 2) == -1);
     }
 
     {
         uint8_t vector[] = {1, 0, 0, 0, 1, 0, 0, 0, 1};
-        matrix[0] = MATRIX_STATIC_ROW(1, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(0, 1, 0);
-        matrix[2] = MATRIX_STATIC_ROW(0, 0, 1);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == 0);
-        assert(matrix_solved_index(1) == 1);
-        assert(matrix_solved_index(2) == 2);
+        rows[0] = MATRIX_STATIC_ROW(1, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(0, 1, 0);
+        rows[2] = MATRIX_STATIC_ROW(0, 0, 1);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == 0);
+        assert(matrix_solved_index(&A, 1) == 1);
+        assert(matrix_solved_index(&A, 2) == 2);
     }
 
     {
         uint8_t vector[] = {1, 0, 0, 0, 1, 0, 0, 0, 1};
-        matrix[0] = MATRIX_STATIC_ROW(5, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(0, 3, 0);
-        matrix[2] = MATRIX_STATIC_ROW(0, 0, 2);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == 0);
-        assert(matrix_solved_index(1) == 1);
-        assert(matrix_solved_index(2) == 2);
+        rows[0] = MATRIX_STATIC_ROW(5, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(0, 3, 0);
+        rows[2] = MATRIX_STATIC_ROW(0, 0, 2);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == 0);
+        assert(matrix_solved_index(&A, 1) == 1);
+        assert(matrix_solved_index(&A, 2) == 2);
     }
 
     {
         uint8_t vector[] = {1, 0, 0, 0, 0, 0, 0, 0, 0};
-        matrix[0] = MATRIX_STATIC_ROW(5, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(2, 0, 0);
-        matrix[2] = MATRIX_STATIC_ROW(9, 0, 0);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == 0);
-        assert(matrix_solved_index(1) == -1);
-        assert(matrix_solved_index(2) == -1);
+        rows[0] = MATRIX_STATIC_ROW(5, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(2, 0, 0);
+        rows[2] = MATRIX_STATIC_ROW(9, 0, 0);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == 0);
+        assert(matrix_solved_index(&A, 1) == -1);
+        assert(matrix_solved_index(&A, 2) == -1);
     }
 
     {
         uint8_t vector[] = {1, 0, 0, 0, 0, 1, 0, 0, 0};
-        matrix[0] = MATRIX_STATIC_ROW(5, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(5, 0, 0);
-        matrix[2] = MATRIX_STATIC_ROW(0, 0, 2);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == 0);
-        assert(matrix_solved_index(1) == 2);
-        assert(matrix_solved_index(2) == -1);
+        rows[0] = MATRIX_STATIC_ROW(5, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(5, 0, 0);
+        rows[2] = MATRIX_STATIC_ROW(0, 0, 2);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == 0);
+        assert(matrix_solved_index(&A, 1) == 2);
+        assert(matrix_solved_index(&A, 2) == -1);
     }
 
     {
         uint8_t vector[] = {1, 0, 0, 0, 1, 0, 0, 0, 1};
-        matrix[0] = MATRIX_STATIC_ROW(1, 2, 3);
-        matrix[1] = MATRIX_STATIC_ROW(4, 4, 7);
-        matrix[2] = MATRIX_STATIC_ROW(3, 6, 10);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == 0);
-        assert(matrix_solved_index(1) == 1);
-        assert(matrix_solved_index(2) == 2);
+        rows[0] = MATRIX_STATIC_ROW(1, 2, 3);
+        rows[1] = MATRIX_STATIC_ROW(4, 4, 7);
+        rows[2] = MATRIX_STATIC_ROW(3, 6, 10);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == 0);
+        assert(matrix_solved_index(&A, 1) == 1);
+        assert(matrix_solved_index(&A, 2) == 2);
     }
 
-    matrix_cols = 5;
-    matrix_rows = 2;
+    A.num_cols = 5;
+    A.num_rows = 2;
 
     {
         uint8_t vector[] = {1, 101, 0, 0, 0, 0, 0, 1, 232, 0};
-        matrix[0] = MATRIX_STATIC_ROW(23, 42, 0, 0, 0);
-        matrix[1] = MATRIX_STATIC_ROW(0, 0, 59, 36, 0);
-        matrix_rref();
-        assert(matrix_debug_compare(vector));
-        assert(matrix_solved_index(0) == -1);
-        assert(matrix_solved_index(1) == -1);
+        rows[0] = MATRIX_STATIC_ROW(23, 42, 0, 0, 0);
+        rows[1] = MATRIX_STATIC_ROW(0, 0, 59, 36, 0);
+        matrix_rref(&A);
+        assert(matrix_debug_compare(&A, vector));
+        assert(matrix_solved_index(&A, 0) == -1);
+        assert(matrix_solved_index(&A, 1) == -1);
     }
 
     /* Big rref */
     uint8_t row_pool[256][256];
     for (k = 0; k < 50; k++) {
-        matrix_rows = sizeof(row_pool)/sizeof(row_pool[0]);
-        matrix_cols = sizeof(row_pool[0])/sizeof(row_pool[0][0]);
-        for (j = 0; j < matrix_rows; j++) {
-            for (i = 0; i < matrix_cols; i++)
+        A.num_rows = sizeof(row_pool)/sizeof(row_pool[0]);
+        A.num_cols = sizeof(row_pool[0])/sizeof(row_pool[0][0]);
+        for (j = 0; j < A.num_rows; j++) {
+            for (i = 0; i < A.num_cols; i++)
                 row_pool[j][i] = rand() % FF_ELEM_NUM;
-            matrix[j] = (uint8_t *)&row_pool[j];
+            rows[j] = (uint8_t *)&row_pool[j];
         }
-        matrix_rref();
+        matrix_rref(&A);
     }
 
     /* Matrix solve interface */
@@ -517,12 +1031,139 @@ void matrix_test(void) {
         uint8_t flat_matrix[] = {1, 2, 3, 0, 4, 4, 7, 0, 3, 6, 10, 0};
         uint16_t solved[5];
         assert(matrix_solve(solved, vector, 3, 4) == 3);
-        assert(matrix_debug_compare(vector));
+        A.num_rows = 3;
+        A.num_cols = 4;
+        for (j = 0; j < A.num_rows; j++)
+            rows[j] = &vector[j*A.num_cols];
+        assert(matrix_debug_compare(&A, vector));
+    }
+
+    /* Sparse matrix solve interface against dense matrix solve */
+    {
+        static uint8_t dense_matrix[96*160], sparse_matrix[96*160];
+        uint16_t dense_solved[160], sparse_solved[160];
+        int m, n, d, num_solved, code_size;
+
+        for (k = 0; k < 200; k++) {
+            m = 1 + rand() % 96;
+            n = 1 + rand() % 160;
+            d = rand() % (1 + (m < n ? m : n));
+            code_size = 1 + rand() % (k % 4 == 0 ? n : 8);
+
+            /* Identity rows for decoded columns, followed by sparse random
+             * linear combination rows */
+            memset(dense_matrix, 0, m*n);
+            for (j = 0; j < d; j++)
+                dense_matrix[j*n + j] = 1;
+            for (j = d; j < m; j++) {
+                for (i = 0; i < code_size; i++)
+                    dense_matrix[j*n + rand() % n] = rand() % FF_ELEM_NUM;
+            }
+            memcpy(sparse_matrix, dense_matrix, m*n);
+
+            num_solved = matrix_solve(dense_solved, dense_matrix, m, n);
+            assert(matrix_solve_sparse(sparse_solved, sparse_matrix, m, n, d) == num_solved);
+            assert(memcmp(dense_solved, sparse_solved, sizeof(uint16_t)*num_solved) == 0);
+
+            /* Remaining rows reduce to the same rref */
+            for (j = 0; j < m - d; j++)
+                assert(memcmp(&sparse_matrix[(j + d)*n], &dense_matrix[(j + d)*n + d], n - d) == 0);
+        }
+    }
+
+    /* Matrix context interface */
+    {
+        uint8_t vector[] = {1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0};
+        uint8_t flat_matrix[] = {1, 2, 3, 0, 4, 4, 7, 0, 3, 6, 10, 0};
+        uint32_t solved[4];
+        matrix_ctx_t *ctx = matrix_ctx_alloc();
+        uint8_t *buffer;
+
+        assert(ctx != NULL);
+
+        buffer = matrix_ctx_load(ctx, 3, 4);
+        memcpy(buffer, flat_matrix, sizeof(flat_matrix));
+        assert(matrix_ctx_solve(ctx, solved, 0) == 3);
+        assert(solved[0] == 0 && solved[1] == 1 && solved[2] == 2);
+        assert(memcmp(buffer, vector, sizeof(vector)) == 0);
+
+        /* Empty matrix */
+        matrix_ctx_load(ctx, 0, 0);
+        assert(matrix_ctx_solve(ctx, solved, 0) == 0);
+
+        matrix_ctx_free(ctx);
+    }
+
+    /* Matrix context beyond 2048 rows and columns */
+    {
+        int m = 3000, n = 2600, d = 2500;
+        uint32_t *solved = malloc(sizeof(uint32_t)*n);
+        matrix_ctx_t *ctx = matrix_ctx_alloc();
+        uint8_t *buffer;
+
+        /* Identity rows, a row solving column d, and rows combining pairs of
+         * the remaining columns */
+        buffer = matrix_ctx_load(ctx, m, n);
+        assert(buffer != NULL);
+        for (j = 0; j < d; j++)
+            buffer[(size_t)j*n + j] = 1;
+        buffer[(size_t)d*n + 0] = 7;
+        buffer[(size_t)d*n + d] = 9;
+        for (j = d + 1; j < m; j++) {
+            buffer[(size_t)j*n + d + 1 + (j % (n - d - 1))] = 1 + (j % 255);
+            buffer[(size_t)j*n + d + 1 + ((j + 1) % (n - d - 1))] = 1 + (j % 253);
+        }
+
+        assert(matrix_ctx_solve(ctx, solved, d) >= d + 1);
+        assert(solved[d - 1] == (uint32_t)(d - 1) && solved[d] == (uint32_t)d);
+
+        matrix_ctx_free(ctx);
+        free(solved);
+    }
+
+    /* Batch of sparse matrices, against solving them one at a time */
+    {
+        int32_t dims[4*3] = { 6, 9, 3,  0, 0, 0,  40, 60, 20,  5, 5, 0 };
+        int32_t row_nnz[3 + 0 + 20 + 5], num_solved[4];
+        uint32_t cols[4*28], solved[9 + 0 + 60 + 5], expected[60];
+        uint8_t coefs[4*28];
+        matrix_ctx_t *ctx = matrix_ctx_alloc();
+        int p, r, nnz = 0, offset;
+        unsigned int seed = 1;
+
+        /* Rows of up to 4 pseudorandom entries */
+        for (p = 0, r = 0; p < 4; p++) {
+            for (j = dims[3*p + 2]; j < dims[3*p]; j++, r++) {
+                row_nnz[r] = 1 + (seed = seed*1103515245 + 12345) % 4;
+                for (k = 0; k < row_nnz[r]; k++, nnz++) {
+                    cols[nnz] = (seed = seed*1103515245 + 12345) % dims[3*p + 1];
+                    coefs[nnz] = 1 + (seed = seed*1103515245 + 12345) % 255;
+                }
+            }
+        }
+
+        assert(matrix_ctx_solve_batch(ctx, 4, dims, row_nnz, cols, coefs, solved, num_solved) ==
+               num_solved[0] + num_solved[1] + num_solved[2] + num_solved[3]);
+        assert(num_solved[1] == 0 && num_solved[2] >= 20);
+
+        for (p = 0, r = 0, nnz = 0, offset = 0; p < 4; p++) {
+            uint8_t *buffer = matrix_ctx_load(ctx, dims[3*p], dims[3*p + 1]);
+            for (j = dims[3*p + 2]; j < dims[3*p]; j++, r++) {
+                for (k = 0; k < row_nnz[r]; k++, nnz++)
+                    buffer[(size_t)j*dims[3*p + 1] + cols[nnz]] = coefs[nnz];
+            }
+            assert(matrix_ctx_solve(ctx, expected, dims[3*p + 2]) == num_solved[p]);
+            assert(memcmp(expected, solved + offset, sizeof(uint32_t)*num_solved[p]) == 0);
+            offset += num_solved[p];
+        }
+
+        matrix_ctx_free(ctx);
     }
 }
 
 int main(void) {
     ff8_test();
+    ff8_region_test();
     matrix_test();
     return 0;
 }
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# NCGAB Simulator Benchmarks
+#
+# Times the simulator hot paths on fixed seeds, and writes the results as
+# JSON, optionally comparing them against the results of a previous run.
+#
+# Run from the directory of ff.so with: python3 src/benchmark.py [options]
+
+import argparse
+import threading
+import platform
+import random
+import copy
+import json
+import time
+import sys
+
+from stats import *
+from log import *
+from network import *
+from message import *
+from window import *
+from peer import *
+from config import SimTemplate
+
+################################################################################
+
+BENCHMARK_SEED = 0x1
+
+# Matrix solves: (rows, columns, leading identity columns, density)
+MATRIX_SOLVE_SIZES = [(16, 16, 0, 1.0), (64, 64, 0, 0.1), (64, 64, 0, 1.0), (128, 256, 96, 0.05), \
+                      (256, 256, 0, 0.05), (256, 256, 0, 1.0), (512, 768, 256, 0.02)]
+# Gossip Window solves: (decoded messages, linear combinations, undecoded messages)
+GOSSIP_SOLVE_SIZES = [(30, 50, 60), (60, 250, 300), (120, 500, 600)]
+# Decoded and Gossip Window choose_random: live objects
+CHOOSE_RANDOM_SIZES = [8, 30, 120, 480]
+# Network lookup_random: number of peers
+NUM_PEERS_SIZES = [10, 50, 100, 500, 1000]
+# Whole rounds: number of peers, which take minutes per round past a few
+# hundred peers
+ROUND_PEERS_SIZES = [10, 50, 100]
+
+def bench_params(numPeers):
+    simParams = copy.deepcopy(SimTemplate)
+    simParams['NAME'] = "Bench-N%d" % numPeers
+    simParams['SEED'] = BENCHMARK_SEED
+    simParams['SIM_NUM_PEERS'] = numPeers
+    simParams['SIM_NUM_EVIL_PEERS'] = 0
+    simParams['CONTRIBUTE_INTERVAL'] = 10
+    simParams['TTL_GOSSIP'] = 10
+    # Never stop, and never write a log
+    simParams['SIM_WARMUP_DECODES'] = float('inf')
+    simParams['SIM_DURATION_INSERTS'] = float('inf')
+    simParams['LOG_EVENTS'] = False
+    simParams['LOG_STREAM'] = False
+    return simParams
+
+def timed(setup, run, repeats):
+    # Seconds of each repeat of run(state), after an untimed setup()
+    times = []
+    for _ in range(repeats):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+################################################################################
+
+def bench_matrix_solve(args):
+    for (m, n, k, density) in MATRIX_SOLVE_SIZES:
+        rng = random.Random(BENCHMARK_SEED)
+        ctx = matrix_context()
+
+        def setup():
+            # Identity over the leading k columns, then random rows
+            matrix = ctx.load(m, n)
+            for i in range(min(k, m)):
+                matrix[n*i + i] = 1
+            for i in range(k, m):
+                for j in range(n):
+                    if rng.random() < density:
+                        matrix[n*i + j] = rng.randint(1, 255)
+
+        def run(state):
+            ctx.solve(k)
+
+        yield ("matrix_solve", {'rows': m, 'cols': n, 'identity': k, 'density': density}, 1, \
+               timed(setup, run, args.repeats))
+
+def gossip_state(numDecoded, numLC, numUndecoded, solver):
+    decoded = Decoded_Window()
+    for _ in range(numDecoded):
+        decoded.add(RealMessage(0), 30)
+
+    # Linear combinations of the decoded and undecoded messages
+    pool = decoded.objects() + [RealMessage(1) for _ in range(numUndecoded)]
+    gossip = Gossip_Window(solver)
+    lcs = [RLC(random.sample(pool, SimTemplate['CODE_SIZE'])) for _ in range(numLC)]
+    for (i, lc) in enumerate(lcs):
+        gossip.add(i % 16, lc, 10)
+
+    return (decoded, gossip, lcs)
+
+def bench_gossip_solve(args):
+    for (numDecoded, numLC, numUndecoded) in GOSSIP_SOLVE_SIZES:
+        params = {'decoded': numDecoded, 'lcs': numLC, 'undecoded': numUndecoded}
+
+        # Matrix building and solve over the whole window, on fresh windows
+        # as solving unchanged windows again is skipped
+        def setup():
+            random.seed(BENCHMARK_SEED)
+            return gossip_state(numDecoded, numLC, numUndecoded, "matrix")
+
+        yield ("gossip_solve_matrix", params, 1, \
+               timed(setup, lambda state: state[1].solve(state[0]), args.repeats))
+
+        # Skipped solve of a window unchanged since its last solve, besides
+        # the decodes of that solve
+        (decoded, gossip, _) = setup()
+        for p in gossip.solve(decoded)[2]:
+            decoded.add(p, 30)
+        yield ("gossip_solve_skipped", params, 1, \
+               timed(lambda: None, lambda state: gossip.solve(decoded), args.repeats))
+
+        # Matrix building and solve over several windows in one call
+        random.seed(BENCHMARK_SEED)
+        windows = [gossip_state(numDecoded, numLC, numUndecoded, "matrix")[1::-1] for _ in range(8)]
+        yield ("gossip_solve_batch", params, len(windows), \
+               timed(lambda: None, lambda state: solve_gossip_windows(windows), args.repeats))
+
+        # Incremental solver, folding in the whole window
+        def setup():
+            random.seed(BENCHMARK_SEED)
+            (decoded, _, lcs) = gossip_state(numDecoded, numLC, numUndecoded, "matrix")
+            return (decoded, Gossip_Window("incremental"), lcs)
+
+        def run(state):
+            (decoded, gossip, lcs) = state
+            for (i, lc) in enumerate(lcs):
+                gossip.add(i % 16, lc, 10)
+            gossip.solve(decoded)
+
+        yield ("gossip_solve_incremental", params, 1, timed(setup, run, args.repeats))
+
+def bench_choose_random(args):
+    calls = 1000
+    for numDecoded in CHOOSE_RANDOM_SIZES:
+        random.seed(BENCHMARK_SEED)
+        decoded = Decoded_Window()
+        # Spread the TTLs, as in a window filled over several rounds
+        for i in range(numDecoded):
+            decoded.add(RealMessage(0), 1 + i % 30)
+
+        def run(state):
+            for _ in range(calls):
+                decoded.choose_random(SimTemplate['CODE_SIZE'])
+
+        yield ("choose_random", {'decoded': numDecoded}, calls, timed(lambda: None, run, args.repeats))
+
+    for numLC in CHOOSE_RANDOM_SIZES:
+        random.seed(BENCHMARK_SEED)
+        (_, gossip, _) = gossip_state(SimTemplate['CODE_SIZE'], 0, SimTemplate['CODE_SIZE'], "matrix")
+        for i in range(numLC):
+            gossip.add(i % 16, RLC([RealMessage(0) for _ in range(SimTemplate['CODE_SIZE'])]), 1 + i % 10)
+
+        def run(state):
+            for _ in range(calls):
+                gossip.choose_random()
+
+        yield ("gossip_choose_random", {'lcs': numLC}, calls, timed(lambda: None, run, args.repeats))
+
+def bench_lookup_random(args):
+    calls = 1000
+    for numPeers in args.peers:
+        random.seed(BENCHMARK_SEED)
+        simParams = bench_params(numPeers)
+        network = Network(Log(simParams), None)
+        for nid in range(numPeers):
+            network.join(0, nid, nid)
+        n = int(simParams['LOOKUP_PERCENT']*numPeers)
+
+        def run(state):
+            for i in range(calls):
+                network.lookup_random(i % numPeers, n)
+
+        yield ("lookup_random", {'peers': numPeers, 'lookups': n}, calls, timed(lambda: None, run, args.repeats))
+
+def bench_round(args):
+    for numPeers in args.round_peers:
+        random.seed(BENCHMARK_SEED)
+        simParams = bench_params(numPeers)
+        simStats = Stats(simParams, threading.Event())
+        simLog = Log(simParams)
+        simNetwork = Network(simLog, simStats)
+        simPeers = [Peer(i, simNetwork, simLog, simStats, simParams) for i in range(numPeers)]
+
+        rounds = [0]
+        def run(state):
+            random.shuffle(simPeers)
+            for n in simPeers:
+                n.simulate(rounds[0])
+            rounds[0] += 1
+
+        # Warm the windows up to their steady state sizes
+        for _ in range(args.warmup):
+            run(None)
+
+        yield ("round", {'peers': numPeers, 'warmup': args.warmup}, 1, timed(lambda: None, run, args.rounds))
+
+BENCHMARKS = [("matrix_solve", bench_matrix_solve), ("gossip_solve", bench_gossip_solve), \
+              ("choose_random", bench_choose_random), ("lookup_random", bench_lookup_random), ("round", bench_round)]
+
+################################################################################
+
+def result(name, params, calls, times):
+    times = sorted(times)
+    return {'name': name, 'params': params, 'calls': calls, 'repeats': len(times),
+            'min': times[0] / calls, 'median': times[len(times)//2] / calls, 'mean': sum(times) / len(times) / calls}
+
+def result_key(r):
+    return r['name'] + json.dumps(r['params'], sort_keys=True)
+
+def result_str(r):
+    return "%-26s %-64s %12.3f us" % (r['name'], json.dumps(r['params'], sort_keys=True), r['min']*1e6)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulator hot paths")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against the JSON results of a previous run")
+    parser.add_argument("--only", action="append", default=[], choices=[name for (name, _) in BENCHMARKS], \
+                        help="only run this benchmark, may be repeated")
+    parser.add_argument("--peers", default=",".join(str(n) for n in NUM_PEERS_SIZES), \
+                        help="comma separated numbers of peers to look up from")
+    parser.add_argument("--round-peers", default=",".join(str(n) for n in ROUND_PEERS_SIZES), \
+                        help="comma separated numbers of peers to simulate rounds of")
+    parser.add_argument("--repeats", type=int, default=5, help="repeats of each benchmark")
+    parser.add_argument("--warmup", type=int, default=30, help="untimed rounds before timing rounds")
+    parser.add_argument("--rounds", type=int, default=3, help="timed rounds")
+    args = parser.parse_args()
+    args.peers = [int(n) for n in args.peers.split(",")]
+    args.round_peers = [int(n) for n in args.round_peers.split(",")]
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = dict((result_key(r), r) for r in json.load(f)['results'])
+
+    results = []
+    for (benchmarkName, benchmark) in BENCHMARKS:
+        if len(args.only) > 0 and benchmarkName not in args.only:
+            continue
+        for (name, params, calls, times) in benchmark(args):
+            r = result(name, params, calls, times)
+            results.append(r)
+
+            # Print the minimum time per call, and the speedup over the baseline
+            s = result_str(r)
+            if result_key(r) in baseline:
+                s += "  %6.2fx" % (baseline[result_key(r)]['min'] / r['min'])
+            print(s)
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'seed': BENCHMARK_SEED, 'results': results}, f, indent=2)
+        print("Wrote results to %s" % args.output)
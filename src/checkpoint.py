@@ -0,0 +1,54 @@
+import tempfile
+import hashlib
+import pickle
+import json
+import zlib
+import os
+
+# Checkpoint file magic, followed by the zlib compressed pickle of the
+# simulation state
+CHECKPOINT_MAGIC = b"NCGABCKP"
+
+# Parameters that do not change a simulation up to the end of its warmup, so
+# simulations differing only in them share their post-warmup snapshot
+WARMUP_IGNORED_PARAMS = ['NAME', 'DESC', 'PRINT_LOG', 'SIM_DURATION_INSERTS', \
+                         'CHECKPOINT_INTERVAL', 'CHECKPOINT_WARMUP', 'CHECKPOINT_FORK']
+
+# Parameters the peers read as they simulate, which a fork of a snapshot may
+# set differently. The others are fixed when the simulation is built.
+FORK_PARAMS = WARMUP_IGNORED_PARAMS + ['CONTRIBUTE_INTERVAL', 'LOOKUP_PERCENT', 'TTL_DECODE', 'TTL_GOSSIP']
+
+def checkpoint_path(simParams):
+    return "data/%s.checkpoint" % simParams['NAME']
+
+def warmup_path(simParams):
+    params = dict((k, v) for (k, v) in simParams.items() if k not in WARMUP_IGNORED_PARAMS)
+    return "data/warmup-%s.checkpoint" % hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def fork_mismatch(snapshotParams, simParams):
+    # Parameters a fork can not change from its snapshot's
+    return sorted(k for k in set(snapshotParams) | set(simParams) \
+                  if k not in FORK_PARAMS and snapshotParams.get(k) != simParams.get(k))
+
+def save_checkpoint(path, simState):
+    # Write to a temporary file of our own and move it into place, so a crash
+    # while writing leaves the previous checkpoint intact, and workers saving
+    # the same warmup snapshot at once each move a whole one into place
+    data = zlib.compress(pickle.dumps(simState, pickle.HIGHEST_PROTOCOL), 1)
+
+    (fd, tmpPath) = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path) or ".")
+    f = os.fdopen(fd, "wb")
+    f.write(CHECKPOINT_MAGIC)
+    f.write(data)
+    f.close()
+    os.replace(tmpPath, path)
+
+def load_checkpoint(path):
+    f = open(path, "rb")
+    if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+        f.close()
+        raise ValueError("%s is not a checkpoint" % path)
+    data = f.read()
+    f.close()
+
+    return pickle.loads(zlib.decompress(data))
@@ -2,6 +2,9 @@ import copy
 
 simConfig = 1
 
+# Number of simulations to run in parallel, 0 for one per CPU
+simWorkers = 1
+
 # Cooperative Peer Simulation
 
 SimTemplate = {
@@ -12,6 +15,17 @@ SimTemplate = {
     'CODE_SIZE':                4,
     'TTL_DECODE':               30,
     'TTL_GOSSIP':               10,
+    'TTL_EXPIRED':              None,
+
+    'GOSSIP_SOLVER':            "matrix",
+    'SIM_ENGINE':               "peer",
+    'SIM_SCHEDULER':            "lockstep",
+    'RNG_STREAMS':              False,
+
+    'LINK_LATENCY_MIN':         0.0,
+    'LINK_LATENCY_MAX':         0.0,
+    'LINK_BANDWIDTH':           None,
+    'PEER_PROCESS_COST':        0.0,
 
     'SIM_NUM_PEERS':            0,
     'SIM_NUM_EVIL_PEERS':       0,
@@ -22,6 +36,18 @@ SimTemplate = {
 
     'SEED':                     0,
 
+    'STATS_FORMAT':             "json",
+    'PROFILE':                  False,
+
+    'CHECKPOINT_INTERVAL':      None,
+    'CHECKPOINT_WARMUP':        False,
+    'CHECKPOINT_FORK':          None,
+
+    'LOG_EVENTS':               True,
+    'LOG_STREAM':               True,
+    'LOG_FORMAT':               "json",
+    'LOG_TYPES':                None,
+    'LOG_SAMPLE':               1,
     'PRINT_LOG':                False,
 }
 
@@ -74,6 +100,17 @@ SimTemplate = {
     'CODE_SIZE':                4,
     'TTL_DECODE':               30,
     'TTL_GOSSIP':               20,
+    'TTL_EXPIRED':              None,
+
+    'GOSSIP_SOLVER':            "matrix",
+    'SIM_ENGINE':               "peer",
+    'SIM_SCHEDULER':            "lockstep",
+    'RNG_STREAMS':              False,
+
+    'LINK_LATENCY_MIN':         0.0,
+    'LINK_LATENCY_MAX':         0.0,
+    'LINK_BANDWIDTH':           None,
+    'PEER_PROCESS_COST':        0.0,
 
     'SIM_NUM_PEERS':            0,
     'SIM_NUM_EVIL_PEERS':       0,
@@ -84,6 +121,18 @@ SimTemplate = {
     'SIM_WARMUP_DECODES':       50,
     'SIM_DURATION_INSERTS':     75,
 
+    'STATS_FORMAT':             "json",
+    'PROFILE':                  False,
+
+    'CHECKPOINT_INTERVAL':      None,
+    'CHECKPOINT_WARMUP':        False,
+    'CHECKPOINT_FORK':          None,
+
+    'LOG_EVENTS':               True,
+    'LOG_STREAM':               True,
+    'LOG_FORMAT':               "json",
+    'LOG_TYPES':                None,
+    'LOG_SAMPLE':               1,
     'PRINT_LOG':                False,
 }
 
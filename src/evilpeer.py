@@ -1,14 +1,8 @@
-import sys
-
-if sys.version_info.major == 2:
-    import Queue as queue
-else:
-    import queue
-
+from network import *
 from window import *
 from message import *
 
-class EvilPeer():
+class EvilPeer(RNG_Owner):
     def __init__(self, nid, simNetwork, simLog, simStats, simParams):
         # Our unique peer ID
         self.nid = nid
@@ -18,70 +12,58 @@ class EvilPeer():
         self.simStats = simStats
         # Simulation parameters
         self.simParams = simParams
+        # Random number generator of our own, or the shared one
+        self.rng = rng_stream(simParams['SEED'], "peer", nid) if simParams['RNG_STREAMS'] else random
 
         # Create a solved message window
         self.decoded_window = Decoded_Window()
 
-        # Create an input queue
-        self.queue = queue.Queue()
+        # Create an input mailbox
+        self.mailbox = Mailbox()
 
         # Join the network
-        self.simNetwork.join(0, nid, self.queue)
+        self.simNetwork.join(0, nid, self.mailbox)
 
 class EvilPeer_Inactive(EvilPeer):
-    def simulate(self, rnd):
-        # Process all received gossip
-        while not self.queue.empty():
-            try:
-                (src, gossip) = self.queue.get(False)
-            except queue.Empty:
-                break
+    # Needs no simulating under the event scheduler
+    idle = True
 
-            # Throw it away...
+    def simulate(self, rnd, elapsed=1):
+        # Process all received gossip, and throw it away...
+        self.mailbox.drain()
 
 class EvilPeer_Underdetermined(EvilPeer):
-    def simulate(self, rnd):
-        # Process all received gossip
-        while not self.queue.empty():
-            try:
-                (src, gossip) = self.queue.get(False)
-            except queue.Empty:
-                break
-
-            # Throw it away...
+    def simulate(self, rnd, elapsed=1):
+        # Process all received gossip, and throw it away...
+        self.mailbox.drain()
 
         # Send our own gossip to all peers
-        dests = self.simNetwork.lookup_random(self.nid, self.simParams['SIM_NUM_PEERS'] - 1)
+        dests = self.simNetwork.lookup_random(self.nid, self.simParams['SIM_NUM_PEERS'] - 1, self.rng)
         for d in dests:
             # Code an RLC of new messages
-            gossip = [ RLC([EvilMessage(self.nid) for i in range(self.simParams['CODE_SIZE'])]) ]
+            gossip = [ RLC([EvilMessage(self.nid, self.rng) for i in range(self.simParams['CODE_SIZE'])], self.rng) ]
 
             # Transmit to the destination
             d.put( (self.nid, gossip) )
 
 class EvilPeer_Decodable(EvilPeer):
-    def simulate(self, rnd):
+    def simulate(self, rnd, elapsed=1):
         # Update the TTLs of our object windows
-        self.decoded_window.tick()
+        for _ in range(elapsed):
+            self.decoded_window.tick()
 
         # Keep our decoded window filled with our own messages
         for _ in range(self.simParams['CODE_SIZE'] - len(self.decoded_window.live_objects())):
-            self.decoded_window.add(EvilMessage(self.nid), self.simParams['CODE_SIZE'])
-
-        # Process all received gossip
-        while not self.queue.empty():
-            try:
-                (src, gossip) = self.queue.get(False)
-            except queue.Empty:
-                break
+            self.decoded_window.add(EvilMessage(self.nid, self.rng), self.simParams['CODE_SIZE'])
 
-            # Throw it away...
+        # Process all received gossip, and throw it away...
+        self.mailbox.drain()
 
         # Send our own gossip to all peers
-        dests = self.simNetwork.lookup_random(self.nid, self.simParams['SIM_NUM_PEERS'] - 1)
+        dests = self.simNetwork.lookup_random(self.nid, self.simParams['SIM_NUM_PEERS'] - 1, self.rng)
         for d in dests:
             # Send RLCs of our current decoded window
-            gossip = [ RLC(self.decoded_window.choose_random(self.simParams['CODE_SIZE'])) ]
+            gossip = [ RLC(self.decoded_window.choose_random(self.simParams['CODE_SIZE'], self.rng), self.rng) ]
 
             # Transmit to the destination
             d.put( (self.nid, gossip) )
@@ -1,15 +1,59 @@
 import json
+import struct
 import termcolor
 import os
 
+# Event types, by their code in binary logs
+EVENT_TYPES = ["join", "leave", "receive", "insert", "reduce", "decode", "finish"]
+
+# Binary log file magic, followed by length-prefixed records of time, nid,
+# event type code and UTF-8 message
+LOG_BINARY_MAGIC = b"NCGABLOG\x01"
+LOG_BINARY_HEADER = struct.Struct("<IIiB")
+
 class Log():
     def __init__(self, simParams):
         self.elog = []
         self.simParams = simParams
+        self.enabled = simParams['LOG_EVENTS']
+
+        # Event types to log, or None for all of them
+        self.types = simParams['LOG_TYPES']
+        # Log one of every LOG_SAMPLE events of each type
+        self.sample = simParams['LOG_SAMPLE']
+        self.sample_count = {}
+
+        # Stream events to the log file as they are logged, or hold them in
+        # memory until dump()
+        self.stream = simParams['LOG_STREAM']
+        self.binary = simParams['LOG_FORMAT'] == "binary"
+        self.path = None
+        self.f = None
+        self.last_time = None
+        # Length of the log file when checkpointed
+        self.offset = 0
+
+    # Callers skip formatting expensive messages when events are not logged
+    def logs(self, etype):
+        return self.enabled and (self.types is None or etype in self.types)
 
     def log(self, rnd, etype, nid, msg):
+        if not self.logs(etype):
+            return
+
+        # Sample events of this type
+        if self.sample > 1:
+            count = self.sample_count.get(etype, 0)
+            self.sample_count[etype] = count + 1
+            if count % self.sample != 0:
+                return
+
         e = { 'time': rnd, 'type': etype, 'nid': nid, 'msg': msg }
-        self.elog.append(e)
+
+        if self.stream:
+            self.write(e)
+        else:
+            self.elog.append(e)
 
         if self.simParams['PRINT_LOG']:
             ejson = json.dumps(e)
@@ -20,18 +64,102 @@ class Log():
             elif etype == "decode": print(termcolor.colored(ejson, "green"))
             else: print(termcolor.colored(ejson, "white"))
 
-    def dump(self):
+    #########################
+
+    def open_file(self):
         i = 0
         while True:
-            path = "logs/%s-%d.log" % (self.simParams['NAME'], i)
+            path = "logs/%s-%d.%s" % (self.simParams['NAME'], i, "bin" if self.binary else "log")
             if not os.path.exists(path):
                 break
             i += 1
 
-        f = open(path, "w")
-        for e in self.elog:
-            f.write(json.dumps(e) + "\n")
+        self.path = path
+        self.f = open(path, "wb", 1 << 16)
+        if self.binary:
+            self.f.write(LOG_BINARY_MAGIC)
+
+    def write(self, e):
+        if self.f is None:
+            self.open_file()
+
+        # Flush the previous round's events, so a crash loses at most a round
+        if self.last_time is not None and e['time'] != self.last_time:
+            self.f.flush()
+        self.last_time = e['time']
+
+        if self.binary:
+            msg = e['msg'].encode('utf-8')
+            self.f.write(LOG_BINARY_HEADER.pack(LOG_BINARY_HEADER.size - 4 + len(msg), e['time'], e['nid'], \
+                                                EVENT_TYPES.index(e['type'])))
+            self.f.write(msg)
+        else:
+            self.f.write((json.dumps(e) + "\n").encode('utf-8'))
+
+    # Checkpoint the log file by its path and the length written to it
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['f'] = None
+        if self.f is not None:
+            self.f.flush()
+            state['offset'] = self.f.tell()
+        return state
+
+    # Continue the log file of a checkpoint, dropping the events logged after
+    # it
+    def resume(self):
+        if self.path is None:
+            return
+        self.f = open(self.path, "r+b", 1 << 16)
+        self.f.truncate(self.offset)
+        self.f.seek(self.offset)
+
+    # Start a log file of our own with the events of a checkpoint, leaving
+    # its log file as it is
+    def fork(self):
+        if self.path is None:
+            return
+        f = open(self.path, "rb")
+        events = f.read(self.offset)
+        f.close()
+
+        self.open_file()
+        self.f.seek(0)
+        self.f.write(events)
+
+    def dump(self):
+        if self.f is None:
+            self.open_file()
+
+        if not self.stream:
+            for e in self.elog:
+                self.write(e)
+            self.elog = []
+
+        self.f.close()
+        self.f = None
+
+        return self.path
+
+def load_log(path):
+    # Generate the events of a JSON lines or binary log file
+    f = open(path, "rb")
+
+    if f.read(len(LOG_BINARY_MAGIC)) != LOG_BINARY_MAGIC:
+        f.seek(0)
+        for line in f:
+            yield json.loads(line.decode('utf-8'))
         f.close()
+        return
 
-        return path
+    while True:
+        header = f.read(LOG_BINARY_HEADER.size)
+        if len(header) < LOG_BINARY_HEADER.size:
+            break
+        (length, rnd, nid, code) = LOG_BINARY_HEADER.unpack(header)
+        msg = f.read(length - (LOG_BINARY_HEADER.size - 4))
+        if len(msg) < length - (LOG_BINARY_HEADER.size - 4):
+            break
+        yield { 'time': rnd, 'type': EVENT_TYPES[code], 'nid': nid, 'msg': msg.decode('utf-8') }
 
+    f.close()
@@ -1,8 +1,13 @@
 import random
 
+# Messages are slotted, and their names are only built when they are logged.
+# Their pids and coefficients are drawn from the random number generator of
+# the peer creating them.
+
 class Message():
-    def __init__(self, name, pid):
-        self.name = name
+    __slots__ = ('pid',)
+
+    def __init__(self, pid):
         self.pid = pid
 
     def __str__(self):
@@ -12,28 +17,49 @@ class Message():
         return (self.pid == other.pid)
 
 class DummyMessage(Message):
-    def __init__(self):
-        pid = random.getrandbits(32)
-        Message.__init__(self, "R%04x" % pid, pid)
+    __slots__ = ()
+
+    def __init__(self, rng=random):
+        Message.__init__(self, rng.getrandbits(32))
+
+    @property
+    def name(self):
+        return "R%04x" % self.pid
 
 class RealMessage(Message):
-    def __init__(self, nid):
-        pid = random.getrandbits(32)
-        Message.__init__(self, "M%d/%04x" % (nid, pid), pid)
+    __slots__ = ('nid',)
+
+    def __init__(self, nid, rng=random):
+        Message.__init__(self, rng.getrandbits(32))
+        self.nid = nid
+
+    @property
+    def name(self):
+        return "M%d/%04x" % (self.nid, self.pid)
 
 class EvilMessage(Message):
-    def __init__(self, nid):
-        pid = random.getrandbits(32)
-        Message.__init__(self, "E%d/%04x" % (nid, pid), pid)
+    __slots__ = ('nid',)
+
+    def __init__(self, nid, rng=random):
+        Message.__init__(self, rng.getrandbits(32))
+        self.nid = nid
+
+    @property
+    def name(self):
+        return "E%d/%04x" % (self.nid, self.pid)
 
 class RLC(Message):
-    def __init__(self, messages):
-        coefs = [random.randint(0, 255) for p in messages]
-        pid = random.getrandbits(32)
-        name = "LC/(" + ",".join([p.name for p in messages]) + ")" + "/(" + \
-                       ",".join(["%02x" % c for c in coefs]) + ")"
-        Message.__init__(self, name, pid)
+    __slots__ = ('messages', 'coefs')
+
+    def __init__(self, messages, rng=random):
+        # Coefficients packed one byte each
+        coefs = bytearray([rng.randint(0, 255) for p in messages])
+        Message.__init__(self, rng.getrandbits(32))
 
         self.messages = messages
         self.coefs = coefs
 
+    @property
+    def name(self):
+        return "LC/(" + ",".join([p.name for p in self.messages]) + ")" + "/(" + \
+                       ",".join(["%02x" % c for c in self.coefs]) + ")"
@@ -1,7 +1,8 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 # NCGAB Simulator - Ivan A. Sergeev
 
+import multiprocessing
 import threading
 import random
 import time
@@ -15,82 +16,241 @@ from message import *
 from window import *
 from peer import *
 from evilpeer import *
+from scheduler import *
+from results import *
+from checkpoint import *
 from config import *
 
 ################################################################################
 
-if __name__ == "__main__":
-    # Make data and logs folders if they don't exist
-    if not os.path.exists("data/"): os.mkdir("data")
-    if not os.path.exists("logs/"): os.mkdir("logs")
-
-    for si in range(len(SimParamsList)):
-        simParams = SimParamsList[si]
-
-        # If we have already completed this simulation, skip it
-        if os.path.exists("data/%s-0.data" % simParams['NAME']):
-            continue
+def build_simulation(simParams):
+    random.seed(simParams['SEED'])
 
-        random.seed(simParams['SEED'])
+    # Simulation objects
+    simStats = Stats(simParams, None)
+    simLog = Log(simParams)
+    simScheduler = Event_Scheduler(simParams) if simParams['SIM_SCHEDULER'] == "event" else None
+    simNetwork = Network(simLog, simStats, simScheduler, simParams['RNG_STREAMS'] and simScheduler is None)
+    simPeers = []
+    simEngine = None
 
-        # Simulation stop event set by simStats
-        simEventStop = threading.Event()
-
-        # Simulation objects
-        simStats = Stats(simParams, simEventStop)
-        simLog = Log(simParams)
-        simNetwork = Network(simLog, simStats)
-        simPeers = []
+    if simParams['SIM_ENGINE'] == "vector":
+        if simScheduler is not None:
+            raise ValueError("vector engine does not support the event scheduler")
 
+        # Simulate the cooperative peers in batched array operations
+        from vecengine import Vector_Engine
+        simEngine = Vector_Engine(simLog, simStats, simParams)
+    else:
         # Add cooperative peers to the network
         for i in range(simParams['SIM_NUM_PEERS'] - simParams['SIM_NUM_EVIL_PEERS']):
             simPeers.append(Peer(i, simNetwork, simLog, simStats, simParams))
 
-        # Add evil peers to the network
-        for i in range(simParams['SIM_NUM_EVIL_PEERS']):
-            if simParams['SIM_EVIL_PEER_TYPE'] == "inactive":
-                evilPeer = EvilPeer_Inactive
-            elif simParams['SIM_EVIL_PEER_TYPE'] == "underdetermined":
-                evilPeer = EvilPeer_Underdetermined
-            elif simParams['SIM_EVIL_PEER_TYPE'] == "decodable":
-                evilPeer = EvilPeer_Decodable
+    # Add evil peers to the network
+    for i in range(simParams['SIM_NUM_EVIL_PEERS']):
+        if simParams['SIM_EVIL_PEER_TYPE'] == "inactive":
+            evilPeer = EvilPeer_Inactive
+        elif simParams['SIM_EVIL_PEER_TYPE'] == "underdetermined":
+            evilPeer = EvilPeer_Underdetermined
+        elif simParams['SIM_EVIL_PEER_TYPE'] == "decodable":
+            evilPeer = EvilPeer_Decodable
+
+        simPeers.append(evilPeer(i + (simParams['SIM_NUM_PEERS'] - simParams['SIM_NUM_EVIL_PEERS']), \
+                            simNetwork, simLog, simStats, simParams))
+
+    if simScheduler is not None:
+        simScheduler.add_peers(simPeers)
 
-            simPeers.append(evilPeer(i + (simParams['SIM_NUM_PEERS'] - simParams['SIM_NUM_EVIL_PEERS']), \
-                                simNetwork, simLog, simStats, simParams))
+    # Simulation state, as checkpointed before each round
+    return {'params': simParams, 'stats': simStats, 'log': simLog, 'scheduler': simScheduler, \
+            'network': simNetwork, 'peers': simPeers, 'engine': simEngine, \
+            'round': 0, 'time_elapsed': 0.0, 'random': None}
 
-        print("\nStarting simulation %d / %d: %s" % (si+1, len(SimParamsList), simParams['NAME']))
+def restore_simulation(simParams):
+    # Resume from our last checkpoint, if it was taken with our parameters
+    path = checkpoint_path(simParams)
+    if simParams['CHECKPOINT_INTERVAL'] is not None and os.path.exists(path):
+        simState = load_checkpoint(path)
+        if simState['params'] == simParams:
+            simState['log'].resume()
+            print("Resuming %s from round %d" % (simParams['NAME'], simState['round']))
+            return simState
 
-        startTime = time.time()
+    # Fork a post-warmup snapshot
+    if simParams['CHECKPOINT_FORK'] is not None:
+        path = simParams['CHECKPOINT_FORK']
+    elif simParams['CHECKPOINT_WARMUP'] and os.path.exists(warmup_path(simParams)):
+        path = warmup_path(simParams)
+    else:
+        return None
 
-        roundCount = 0
-        while True:
+    simState = load_checkpoint(path)
+    mismatch = fork_mismatch(simState['params'], simParams)
+    if len(mismatch) > 0:
+        raise ValueError("forking %s with different %s" % (path, ", ".join(mismatch)))
+
+    # The simulation objects share one parameters dictionary, which takes on
+    # our parameters
+    simState['params'].clear()
+    simState['params'].update(simParams)
+    simState['log'].fork()
+    print("Forking %s from round %d of %s" % (simParams['NAME'], simState['round'], path))
+
+    return simState
+
+def run_simulation(si, simParams, showProgress=True):
+    simState = restore_simulation(simParams)
+    if simState is None:
+        simState = build_simulation(simParams)
+    else:
+        random.setstate(simState['random'])
+
+    simStats = simState['stats']
+    simLog = simState['log']
+    simScheduler = simState['scheduler']
+    simNetwork = simState['network']
+    simPeers = simState['peers']
+    simEngine = simState['engine']
+
+    # Simulation stop event set by simStats
+    simEventStop = threading.Event()
+    simStats.simEventStop = simEventStop
+
+    def checkpoint(path, roundCount):
+        simState['round'] = roundCount
+        simState['time_elapsed'] = time.time() - startTime
+        simState['random'] = random.getstate()
+        save_checkpoint(path, simState)
+
+    print("\nStarting simulation %d / %d: %s" % (si+1, len(SimParamsList), simParams['NAME']))
+
+    startTime = time.time() - simState['time_elapsed']
+
+    roundCount = simState['round']
+    warmedUp = simStats.warmed_up()
+    while True:
+        # With random number streams, the peers of a round see the same
+        # warmup and duration
+        if simParams['RNG_STREAMS']:
+            simStats.round_started()
+
+        if simScheduler is not None:
+            # Handle the peer activations and deliveries due this round
+            simScheduler.simulate(roundCount)
+        elif simParams['RNG_STREAMS']:
+            # Simulate the peers in order of peer id, which only orders their
+            # records, and deliver their gossip for the next round
+            for n in simPeers:
+                n.simulate(roundCount)
+            simNetwork.deliver()
+        else:
             # Simulate the peers in a different order each round
             random.shuffle(simPeers)
             for n in simPeers:
                 n.simulate(roundCount)
+        if simEngine is not None:
+            simEngine.simulate(roundCount)
 
+        if showProgress:
             sys.stdout.write("\r%d, %d -- Round %d" % \
                 (len(simStats._message_inserts), len(simStats._message_decodes), roundCount+1))
-            # Stop the simulation if we've collected enough data
-            if simEventStop.is_set():
-                break
+        # Stop the simulation if we've collected enough data
+        if simEventStop.is_set():
+            break
 
-            roundCount += 1
+        roundCount += 1
 
-        endTime = time.time()
+        # Snapshot the simulation once it is warmed up, for simulations that
+        # differ only after their warmup to fork, unless another simulation
+        # running alongside already did
+        if not warmedUp and simStats.warmed_up():
+            warmedUp = True
+            if simParams['CHECKPOINT_WARMUP'] and not os.path.exists(warmup_path(simParams)):
+                checkpoint(warmup_path(simParams), roundCount)
 
-        # Log the finish
-        simStats.round_finished(roundCount)
-        simStats.time_elapsed(endTime - startTime)
-        simStats.time_finished(endTime)
-        simLog.log(roundCount, "finish", 0, "")
+        # Checkpoint the simulation to resume it from
+        if simParams['CHECKPOINT_INTERVAL'] is not None and roundCount % simParams['CHECKPOINT_INTERVAL'] == 0:
+            checkpoint(checkpoint_path(simParams), roundCount)
 
+    endTime = time.time()
+
+    # Log the finish
+    simStats.round_finished(roundCount)
+    simStats.time_elapsed(endTime - startTime)
+    simStats.time_finished(endTime)
+    simLog.log(roundCount, "finish", 0, "")
+
+    if showProgress:
         print()
 
-        # Dump stats
-        print("Wrote stats to %s" % simStats.dump())
-        # Dump log
-        print("Wrote log to %s" % simLog.dump())
-        # Print time elapsed
-        print("Time elapsed: %.3f sec" % (endTime - startTime))
+    # Dump stats
+    dataPath = simStats.dump()
+    print("Wrote stats to %s" % dataPath)
+    if simStats.profile is not None:
+        print("Wrote profile to %s.profile" % dataPath)
+    # Dump log
+    logPath = simLog.dump()
+    print("Wrote log to %s" % logPath)
+    # Print time elapsed
+    print("Time elapsed: %.3f sec" % (endTime - startTime))
+
+    # Finished simulations are not resumed
+    if os.path.exists(checkpoint_path(simParams)):
+        os.remove(checkpoint_path(simParams))
+
+    return (dataPath, logPath, simStats.summary())
+
+def run_simulation_worker(args):
+    (si, simParams) = args
+
+    # Record the simulation as running once a worker starts it
+    simResults = Results_DB()
+    simResults.started(simParams)
+    simResults.close()
+
+    result = run_simulation(si, simParams, showProgress=False)
+    sys.stdout.flush()
+    return (si, result)
+
+################################################################################
+
+if __name__ == "__main__":
+    # Make data and logs folders if they don't exist
+    if not os.path.exists("data/"): os.mkdir("data")
+    if not os.path.exists("logs/"): os.mkdir("logs")
+
+    # Sweep results store, where simulations still running are left over
+    # from an interrupted sweep
+    simResults = Results_DB()
+    simResults.interrupted()
+
+    # Gather the simulations we have not completed yet
+    simsToRun = []
+    for si in range(len(SimParamsList)):
+        simParams = SimParamsList[si]
+
+        # If we have already completed a simulation with the same parameters,
+        # skip it
+        if simResults.finished(simParams):
+            simResults.rename(simParams)
+            continue
+
+        simsToRun.append( (si, simParams) )
+
+    numWorkers = simWorkers if simWorkers > 0 else multiprocessing.cpu_count()
+
+    if numWorkers == 1:
+        for (si, simParams) in simsToRun:
+            simResults.started(simParams)
+            (dataPath, logPath, summary) = run_simulation(si, simParams)
+            simResults.finish(simParams, dataPath, logPath, summary)
+    else:
+        # Each worker process imports its own copy of the simulator, including
+        # the ctypes matrix buffers, so simulations share no state
+        pool = multiprocessing.Pool(numWorkers)
+        for (si, (dataPath, logPath, summary)) in pool.imap_unordered(run_simulation_worker, simsToRun):
+            simResults.finish(SimParamsList[si], dataPath, logPath, summary)
+        pool.close()
+        pool.join()
 
+    simResults.close()
@@ -1,23 +1,113 @@
+import hashlib
+import operator
 import random
 
+def rng_stream(seed, *key):
+    # Random number generator of its own for the stream named by key, derived
+    # from the simulation seed
+    digest = hashlib.sha256(repr((seed,) + key).encode('utf-8')).digest()
+    return random.Random(int.from_bytes(digest, 'little'))
+
+class RNG_Owner():
+    # Base of the peers, whose "rng" is a stream of their own or the shared
+    # random module. The module can not be pickled with a checkpoint, and its
+    # state is saved with the simulation instead.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if state['rng'] is random:
+            state['rng'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.rng is None:
+            self.rng = random
+
+class Mailbox():
+    # Gossip delivered to a peer, in the order it was sent, and drained by
+    # the peer in one step. Peers are simulated in a single thread, so
+    # delivery needs no locking.
+    __slots__ = ('messages',)
+
+    def __init__(self):
+        self.messages = []
+
+    def put(self, item):
+        self.messages.append(item)
+
+    def drain(self):
+        messages = self.messages
+        self.messages = []
+        return messages
+
+    def __len__(self):
+        return len(self.messages)
+
+class Round_Mailbox():
+    # Stands in for a peer's mailbox on the network, holding gossip put into
+    # it until the network delivers the round's gossip
+    __slots__ = ('network', 'mailbox')
+
+    def __init__(self, network, mailbox):
+        self.network = network
+        self.mailbox = mailbox
+
+    def put(self, item):
+        self.network.outbox.append((item[0], self.mailbox, item))
+
 class Network():
-    def __init__(self, simLog, simStats):
+    def __init__(self, simLog, simStats, simScheduler=None, roundDelivery=False):
         self.simLog = simLog
         self.simStats = simStats
+        # Event scheduler delivering gossip over links, or None to deliver
+        # it immediately
+        self.simScheduler = simScheduler
+        # Deliver gossip at the end of the round instead, in order of source,
+        # and the (source, mailbox, gossip) sent this round
+        self.roundDelivery = roundDelivery
+        self.outbox = []
         self.network = {}
+        # Peer ids in an array, and the index of each peer id in the array,
+        # for sampling peers without copying the network
+        self.peers = []
+        self.peer_index = {}
 
     def join(self, rnd, nid, q):
+        if nid not in self.network:
+            self.peer_index[nid] = len(self.peers)
+            self.peers.append(nid)
+        if self.simScheduler is not None:
+            q = self.simScheduler.mailbox(nid, q)
+        elif self.roundDelivery:
+            q = Round_Mailbox(self, q)
         self.network[nid] = q
         self.simLog.log(rnd, "join", nid, "")
 
     def leave(self, rnd, nid):
         if nid in self.network:
             del self.network[nid]
+
+            # Move the last peer id into the leaving peer's slot
+            i = self.peer_index.pop(nid)
+            last = self.peers.pop()
+            if last != nid:
+                self.peers[i] = last
+                self.peer_index[last] = i
+
             self.simLog.log(rnd, "leave", nid, "")
 
-    def lookup_random(self, nid, n):
-        choices = list(self.network.keys())
-        choices.remove(nid)
-        random.shuffle(choices)
-        return [self.network[choices[i]] for i in range(n)]
+    def lookup_random(self, nid, n, rng=random):
+        # Sample n indices of the other peers, skipping over our own index
+        i = self.peer_index[nid]
+        indices = rng.sample(range(len(self.peers) - 1), n)
+        return [self.network[self.peers[k + (k >= i)]] for k in indices]
 
+    def deliver(self):
+        # Deliver the gossip sent this round, so that the gossip a peer
+        # receives does not depend on the order the peers were simulated in.
+        # Each source sends to a peer at most once a round.
+        outbox = self.outbox
+        self.outbox = []
+        outbox.sort(key=operator.itemgetter(0))
+        for (_, mailbox, item) in outbox:
+            mailbox.put(item)
@@ -1,14 +1,8 @@
-import sys
-
-if sys.version_info.major == 2:
-    import Queue as queue
-else:
-    import queue
-
+from network import *
 from window import *
 from message import *
 
-class Peer():
+class Peer(RNG_Owner):
     def __init__(self, nid, simNetwork, simLog, simStats, simParams):
         # Our unique peer ID
         self.nid = nid
@@ -18,69 +12,81 @@ class Peer():
         self.simStats = simStats
         # Simulation parameters
         self.simParams = simParams
+        # Random number generator of our own, or the shared one
+        self.rng = rng_stream(simParams['SEED'], "peer", nid) if simParams['RNG_STREAMS'] else random
 
-        # Create an input queue
-        self.queue = queue.Queue()
+        # Create an input mailbox
+        self.mailbox = Mailbox()
         # Create a solved message window
-        self.decoded_window = Decoded_Window()
+        self.decoded_window = Decoded_Window(self.simParams['TTL_EXPIRED'], self.simStats.tracked_pids())
         # Create a gossip window
-        self.gossip_window = Gossip_Window()
+        self.gossip_window = Gossip_Window(self.simParams['GOSSIP_SOLVER'], self.simStats.tracked_pids(), \
+                                           self.simStats.profile)
 
         # Initialize our window with dummy messages
         for _ in range(self.simParams['CODE_SIZE']):
-            self.decoded_window.add(DummyMessage(), self.simParams['TTL_DECODE'])
+            self.decoded_window.add(DummyMessage(self.rng), self.simParams['TTL_DECODE'])
 
         # Choose an initial random insert message timeout
-        self.insert_message_timeout = int(random.randint(0, int(self.simParams['CONTRIBUTE_INTERVAL'])))
+        self.insert_message_timeout = int(self.rng.randint(0, int(self.simParams['CONTRIBUTE_INTERVAL'])))
 
         # Join the network
-        self.simNetwork.join(0, nid, self.queue)
+        self.simNetwork.join(0, nid, self.mailbox)
 
-    def simulate(self, rnd):
-        # Update the TTLs of our object windows
-        self.decoded_window.tick()
-        self.gossip_window.tick()
+    def simulate(self, rnd, elapsed=1):
+        profile = self.simStats.profile
+        if profile is not None:
+            profile.start(rnd)
+
+        # Update the TTLs of our object windows, over the rounds elapsed since
+        # we were last simulated
+        for _ in range(elapsed):
+            self.decoded_window.tick()
+            self.gossip_window.tick()
+        if profile is not None:
+            profile.lap("tick")
 
         # Keep track of the last tracked message disappearing
-        self.simStats.message_track(rnd, self.decoded_window.live_objects(), self.gossip_window.live_objects())
+        self.simStats.message_track(rnd, self.decoded_window.num_tracked() + self.gossip_window.num_tracked() > 0)
         # Log our window sizes
-        self.simStats.window_size(rnd, self.nid, len(self.decoded_window.objects()), len(self.gossip_window.objects()))
+        self.simStats.window_size(rnd, self.nid, self.decoded_window.num_objects(), self.gossip_window.num_objects())
 
         # Decrement our insert message timeout counter
-        self.insert_message_timeout = max(0, self.insert_message_timeout - 1)
+        self.insert_message_timeout = max(0, self.insert_message_timeout - elapsed)
 
         # Introduce a new message if our random insert timeout expired, but only
         # if we've have a Decoded Window of at least CODE_SIZE
         if self.insert_message_timeout == 0:
-            p = RealMessage(self.nid)
+            p = RealMessage(self.nid, self.rng)
             # Add a real message to our decoded window
             if self.decoded_window.add(p, self.simParams['TTL_DECODE']):
                 # Log the insert
                 self.simLog.log(rnd, "insert", self.nid, str(p))
                 self.simStats.message_insert(rnd, self.nid, p.pid)
+                self.decoded_window.track(p)
 
             # Choose a new insert message timeout
             self.insert_message_timeout = int(self.simParams['CONTRIBUTE_INTERVAL'])
+        if profile is not None:
+            profile.lap("track")
 
         # Process all received gossip
-        while not self.queue.empty():
-            try:
-                (src, gossip) = self.queue.get(False)
-            except queue.Empty:
-                break
-
+        for (src, gossip) in self.mailbox.drain():
             # Add the linear combinations to our gossip window
             for lc in gossip:
                 self.gossip_window.add(src, lc, self.simParams['TTL_GOSSIP'])
 
             # Log the receive
-            self.simLog.log(rnd, "receive", self.nid, "src: %d, gossip: %s" % (src, str([str(p) for p in gossip])))
+            if self.simLog.logs("receive"):
+                self.simLog.log(rnd, "receive", self.nid, "src: %d, gossip: %s" % (src, str([str(p) for p in gossip])))
+        if profile is not None:
+            profile.lap("drain")
 
         # Try to solve some gossip
         (m_numrows, m_numcols, solved) = self.gossip_window.solve(self.decoded_window)
         # Log the reduce attempt
         self.simLog.log(rnd, "reduce", self.nid, "%dx%d to %d" % (m_numrows, m_numcols, len(solved)))
-        self.simStats.matrix_reduce(rnd, self.nid, m_numrows, m_numcols, len(solved))
+        self.simStats.matrix_reduce(rnd, self.nid, m_numrows, m_numcols, len(solved), self.gossip_window.skipped)
 
         # Add the decoded messages to our Decoded Window
         for p in solved:
@@ -92,21 +98,26 @@ class Peer():
 
         # Fill up Decoded Window with dummy messages if it is short
         for _ in range(self.simParams['CODE_SIZE'] - len(self.decoded_window.live_objects())):
-            self.decoded_window.add(DummyMessage(), self.simParams['TTL_DECODE'])
+            self.decoded_window.add(DummyMessage(self.rng), self.simParams['TTL_DECODE'])
+        if profile is not None:
+            profile.lap("fill")
 
         # Look up LOOKUP_PERCENT subset of peers on the network
-        dests = self.simNetwork.lookup_random(self.nid, int(self.simParams['LOOKUP_PERCENT']*self.simParams['SIM_NUM_PEERS']))
+        dests = self.simNetwork.lookup_random(self.nid, int(self.simParams['LOOKUP_PERCENT']*self.simParams['SIM_NUM_PEERS']), \
+                                              self.rng)
         for d in dests:
             gossip = []
 
-            if random.getrandbits(1):
+            if self.rng.getrandbits(1):
                 # Code new-gossip from our Decoded Window
-                gossip.append(RLC(self.decoded_window.choose_random(self.simParams['CODE_SIZE'])))
+                gossip.append(RLC(self.decoded_window.choose_random(self.simParams['CODE_SIZE'], self.rng), self.rng))
             else:
                 # Choose re-gossip from our Gossip Window
-                if len(self.gossip_window.live_objects()) > 0:
-                    gossip.append(self.gossip_window.choose_random())
+                if self.gossip_window.num_objects() > 0:
+                    gossip.append(self.gossip_window.choose_random(self.rng))
 
             # Transmit to the destination
             d.put( (self.nid, gossip) )
+        if profile is not None:
+            profile.lap("send")
 
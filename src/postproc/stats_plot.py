@@ -1,5 +1,98 @@
+import multiprocessing
+import hashlib
+import json
+import os
+import sys
+
 from stats_process import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from results import Results_DB
+
+################################################################################
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def summarize_simulation(filename):
+    return ProcStats(filename).summary()
+
+def load_summaries(filenames, workers=0):
+    # Summaries are cached in a sidecar file next to each data file, keyed by
+    # the data file's mtime and hash
+    summaries = {}
+    stale = []
+    for filename in filenames:
+        sidecar = filename + ".summary"
+        mtime = os.path.getmtime(filename)
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                cached = json.load(f)
+            if cached['mtime'] == mtime:
+                summaries[filename] = cached['summary']
+                continue
+            # Touched but unchanged data files keep their summary
+            digest = file_hash(filename)
+            if cached['hash'] == digest:
+                summaries[filename] = cached['summary']
+                cached['mtime'] = mtime
+                with open(sidecar, "w") as f:
+                    json.dump(cached, f)
+                continue
+        stale.append(filename)
+
+    # Summarize the new and changed data files in parallel
+    if len(stale) > 1 and workers != 1:
+        pool = multiprocessing.Pool(workers if workers > 0 else None)
+        results = pool.map(summarize_simulation, stale)
+        pool.close()
+        pool.join()
+    else:
+        results = [summarize_simulation(filename) for filename in stale]
+
+    for (filename, summary) in zip(stale, results):
+        summaries[filename] = summary
+        with open(filename + ".summary", "w") as f:
+            json.dump({'mtime': os.path.getmtime(filename), 'hash': file_hash(filename), 'summary': summary}, f)
+
+    return [summaries[filename] for filename in filenames]
+
+def summary_str(summary):
+    # Same line as str(ProcStats)
+    s = summary['simParams']['NAME']
+    s += "\tNum inserts: %d" % summary['num_inserts']
+    s += "\tDecode Percent: %.2f\t" % summary['avg_pdecode'][0]
+    s += "\tAvg Delay: %.6f" % summary['avg_delay'][0]
+    s += "\tMin Delay: %.6f" % summary['avg_delay_min']
+    s += "\tMax Delay: %.6f" % summary['avg_delay_max']
+    return s
+
+def aggregate_by_num_peers(simSummaryList, x, y):
+    # Group the y values of simulations by number of peers, then by x
+    data = {}
+    for sim in simSummaryList:
+        params = sim['simParams']
+        data.setdefault(params['SIM_NUM_PEERS'], {}).setdefault(x(params), []).append(y(sim))
+    return data
+
+def contribute_interval(params):
+    return params['CONTRIBUTE_INTERVAL']
+
+def percent_evil(params):
+    return 100.0 * params['SIM_NUM_EVIL_PEERS'] / float(params['SIM_NUM_PEERS'])
+
+def avg_pdecode(sim):
+    return sim['avg_pdecode'][0]
+
+def avg_delay(sim):
+    return sim['avg_delay'][0]
+
+################################################################################
+
 def plot_simulation_pdecodes_vs_time(simProcStats):
     (times, _, pdecode) = simProcStats.compute_pdecodes()
     avg_pdecode = avg(pdecode)
@@ -14,45 +107,27 @@ def plot_simulation_pdecodes_vs_time(simProcStats):
     pylab.ylim([0, 101])
 
 def plot_simulation_window_sizes_vs_time(simProcStats):
-    time = {}
-    solved_size = {}
-    gossip_size = {}
-
-    for (t, nid, ss, gs) in simProcStats.window_sizes:
-        if nid not in time:
-            time[nid] = []
-            solved_size[nid] = []
-            gossip_size[nid] = []
-
-        time[nid].append(t)
-        solved_size[nid].append(ss)
-        gossip_size[nid].append(gs)
+    columns = simProcStats.columns('window_sizes')
+    nids = numpy.unique(columns['nid'])
 
     pylab.figure()
-    for nid in time.keys():
-        pylab.plot(time[nid], solved_size[nid])
+    for nid in nids:
+        rows = columns['nid'] == nid
+        pylab.plot(columns['time'][rows], columns['solved_size'][rows])
     pylab.title('Solved Window Size')
     pylab.xlabel('Time')
     pylab.ylabel('Items')
 
     pylab.figure()
-    for nid in time.keys():
-        pylab.plot(time[nid], gossip_size[nid])
+    for nid in nids:
+        rows = columns['nid'] == nid
+        pylab.plot(columns['time'][rows], columns['gossip_size'][rows])
     pylab.title('Gossip Window Size')
     pylab.xlabel('Time')
     pylab.ylabel('Items')
 
-def plot_aggregate_pdecode_vs_throughput(simProcStatsList, plotFilePrefix=None):
-    data = {}
-    for sim in simProcStatsList:
-        params = sim.simParams
-        numPeers = params['SIM_NUM_PEERS']
-        contributeInterval = params['CONTRIBUTE_INTERVAL']
-        if numPeers not in data:
-            data[numPeers] = {}
-        if contributeInterval not in data[numPeers]:
-            data[numPeers][contributeInterval] = []
-        data[numPeers][contributeInterval].append(sim.compute_avg_pdecode()[0])
+def plot_aggregate_pdecode_vs_throughput(simSummaryList, plotFilePrefix=None):
+    data = aggregate_by_num_peers(simSummaryList, contribute_interval, avg_pdecode)
 
     pylab.figure()
     for numPeers in sorted(data.keys()):
@@ -70,17 +145,8 @@ def plot_aggregate_pdecode_vs_throughput(simProcStatsList, plotFilePrefix=None):
     if plotFilePrefix is not None:
         pylab.savefig(plotFilePrefix + "-availability.eps")
 
-def plot_aggregate_delay_vs_throughput(simProcStatsList, plotFilePrefix=None):
-    data = {}
-    for sim in simProcStatsList:
-        params = sim.simParams
-        numPeers = params['SIM_NUM_PEERS']
-        contributeInterval = params['CONTRIBUTE_INTERVAL']
-        if numPeers not in data:
-            data[numPeers] = {}
-        if contributeInterval not in data[numPeers]:
-            data[numPeers][contributeInterval] = []
-        data[numPeers][contributeInterval].append(sim.compute_avg_delay()[0])
+def plot_aggregate_delay_vs_throughput(simSummaryList, plotFilePrefix=None):
+    data = aggregate_by_num_peers(simSummaryList, contribute_interval, avg_delay)
 
     pylab.figure()
     for numPeers in sorted(data.keys()):
@@ -98,17 +164,8 @@ def plot_aggregate_delay_vs_throughput(simProcStatsList, plotFilePrefix=None):
     if plotFilePrefix is not None:
         pylab.savefig(plotFilePrefix + "-delay.eps")
 
-def plot_aggregate_pdecode_vs_evil_nodes(simProcStatsList, plotFilePrefix=None):
-    data = {}
-    for sim in simProcStatsList:
-        params = sim.simParams
-        numPeers = params['SIM_NUM_PEERS']
-        percentEvil = 100.0 * params['SIM_NUM_EVIL_PEERS'] / float(params['SIM_NUM_PEERS'])
-        if numPeers not in data:
-            data[numPeers] = {}
-        if percentEvil not in data[numPeers]:
-            data[numPeers][percentEvil] = []
-        data[numPeers][percentEvil].append(sim.compute_avg_pdecode()[0])
+def plot_aggregate_pdecode_vs_evil_nodes(simSummaryList, plotFilePrefix=None):
+    data = aggregate_by_num_peers(simSummaryList, percent_evil, avg_pdecode)
 
     pylab.figure()
     for numPeers in sorted(data.keys()):
@@ -126,17 +183,8 @@ def plot_aggregate_pdecode_vs_evil_nodes(simProcStatsList, plotFilePrefix=None):
     if plotFilePrefix is not None:
         pylab.savefig(plotFilePrefix + "-availability.eps")
 
-def plot_aggregate_delay_vs_evil_nodes(simProcStatsList, plotFilePrefix=None):
-    data = {}
-    for sim in simProcStatsList:
-        params = sim.simParams
-        numPeers = params['SIM_NUM_PEERS']
-        percentEvil = 100.0 * params['SIM_NUM_EVIL_PEERS'] / float(params['SIM_NUM_PEERS'])
-        if numPeers not in data:
-            data[numPeers] = {}
-        if percentEvil not in data[numPeers]:
-            data[numPeers][percentEvil] = []
-        data[numPeers][percentEvil].append(sim.compute_avg_delay()[0])
+def plot_aggregate_delay_vs_evil_nodes(simSummaryList, plotFilePrefix=None):
+    data = aggregate_by_num_peers(simSummaryList, percent_evil, avg_delay)
 
     pylab.figure()
     for numPeers in sorted(data.keys()):
@@ -157,7 +205,7 @@ def plot_aggregate_delay_vs_evil_nodes(simProcStatsList, plotFilePrefix=None):
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: %s <simulation files>" % sys.argv[0])
+        print("Usage: %s <simulation files | results database> [name prefix]" % sys.argv[0])
         sys.exit(1)
 
     # Make plots folder if it doesn't exist
@@ -184,10 +232,31 @@ if __name__ == "__main__":
               'font.family': 'serif'}
     pylab.rcParams.update(params)
 
-    simDataFiles = sys.argv[2:]
+    # Skip the files written next to data files, unless the results store is
+    # given first
+    simDataFiles = data_files(sys.argv[2:])
+
+    if sys.argv[2].endswith(".db"):
+        # Query the sweep results store, for simulations whose name starts with
+        # the optional prefix
+        namePrefix = sys.argv[3] if len(sys.argv) > 3 else ""
+        db = Results_DB(sys.argv[2])
+        simSummaryList = db.summaries(namePrefix)
+        db.close()
+        for s in simSummaryList:
+            print(summary_str(s) + "\n")
+
+        if namePrefix.startswith("Evil"):
+            plot_aggregate_pdecode_vs_evil_nodes(simSummaryList)
+            plot_aggregate_delay_vs_evil_nodes(simSummaryList)
+        else:
+            plot_aggregate_pdecode_vs_throughput(simSummaryList)
+            plot_aggregate_delay_vs_throughput(simSummaryList)
+
+        pylab.show()
 
-    if len(simDataFiles) == 1:
-        simProcStats = ProcStats(simDataFiles)
+    elif len(simDataFiles) == 1:
+        simProcStats = ProcStats(simDataFiles[0])
         print(str(simProcStats))
 
         plot_simulation_pdecodes_vs_time(simProcStats)
@@ -195,16 +264,16 @@ if __name__ == "__main__":
         pylab.show()
 
     else:
-        simProcStatsList = [ ProcStats(s) for s in simDataFiles ]
-        for s in simProcStatsList:
-            print(str(s) + "\n")
+        simSummaryList = load_summaries(simDataFiles)
+        for s in simSummaryList:
+            print(summary_str(s) + "\n")
 
         if "Evil" in sys.argv[2]:
-            plot_aggregate_pdecode_vs_evil_nodes(simProcStatsList)
-            plot_aggregate_delay_vs_evil_nodes(simProcStatsList)
+            plot_aggregate_pdecode_vs_evil_nodes(simSummaryList)
+            plot_aggregate_delay_vs_evil_nodes(simSummaryList)
         else:
-            plot_aggregate_pdecode_vs_throughput(simProcStatsList)
-            plot_aggregate_delay_vs_throughput(simProcStatsList)
+            plot_aggregate_pdecode_vs_throughput(simSummaryList)
+            plot_aggregate_delay_vs_throughput(simSummaryList)
 
         pylab.show()
 
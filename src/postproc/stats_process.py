@@ -4,30 +4,44 @@
 
 import sys
 import json
+import os
 import numpy
 import pylab
 
+# Share the data file format with the simulator's stats writer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from stats import MATRIX_REDUCE_FIELDS, WINDOW_SIZE_FIELDS, STATS_COLUMNAR_MAGIC, ci_95, summary_metrics
+
+# Files written next to the data files in data/: summaries, profiles, the
+# results store and checkpoints
+NON_DATA_SUFFIXES = (".summary", ".profile", ".db", ".checkpoint", ".tmp")
+
+def data_files(paths):
+    # Simulation data files among "paths", such as a data/* glob
+    return [p for p in paths if not p.endswith(NON_DATA_SUFFIXES)]
+
 def avg(x):
     if len(x) > 0:
-        return (sum(x) / float(len(x)))
+        return float(numpy.mean(x))
     return 0.0
 
-def ci_95(x):
-    std = numpy.std(x)
-    ci = 1.96*std/numpy.sqrt(len(x))
-    return ci
-
 class ProcStats():
     def __init__(self, filename):
-        with open(filename) as f:
-            data = json.loads(f.read())
+        with open(filename, "rb") as f:
+            columnar = f.read(len(STATS_COLUMNAR_MAGIC)) == STATS_COLUMNAR_MAGIC
+
+        if columnar:
+            data = self.load_columnar(filename)
+        else:
+            with open(filename) as f:
+                data = json.loads(f.read())
+            self._tables = {'matrix_reduces': data['matrix_reduces'], 'window_sizes': data['window_sizes']}
+            self._columns = {}
 
         print("Loaded %s %s" % (data['simParams']['NAME'], data['simParams']['DESC']))
         self.simParams = data['simParams']
         self.message_inserts = data['message_inserts']
         self.message_decodes = data['message_decodes']
-        self.matrix_reduces = data['matrix_reduces']
-        self.window_sizes = data['window_sizes']
 
         # Convert string keys back to integer keys (JSON doesn't support
         # integer keys in dictionaries)
@@ -36,6 +50,51 @@ class ProcStats():
             conv_message_decodes[int(k)] = self.message_decodes[k]
         self.message_decodes = conv_message_decodes
 
+        # Memoized analysis results
+        self._memo = {}
+
+    def load_columnar(self, filename):
+        # Map the file, and view the columns in place without reading them
+        self._map = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+        start = len(STATS_COLUMNAR_MAGIC)
+        header_len = int(self._map[start:start+8].view('<u8')[0])
+        data = json.loads(self._map[start+8:start+8+header_len].tobytes().decode('utf-8'))
+        base = start + 8 + header_len
+
+        self._tables = {}
+        self._columns = {}
+        for (name, fields) in data['columns'].items():
+            self._columns[name] = {}
+            for (field, (offset, length, dtype)) in fields.items():
+                size = length*numpy.dtype(dtype).itemsize
+                self._columns[name][field] = self._map[base+offset:base+offset+size].view(dtype)
+
+        return data
+
+    # NumPy array per field of the "name" statistics
+    def columns(self, name):
+        if name not in self._columns:
+            fields = MATRIX_REDUCE_FIELDS if name == 'matrix_reduces' else WINDOW_SIZE_FIELDS
+            rows = numpy.array(self._tables[name], dtype=numpy.int64).reshape(-1, len(fields))
+            self._columns[name] = dict(zip(fields, rows.T))
+        return self._columns[name]
+
+    # Rows of the "name" statistics, as lists
+    def table(self, name):
+        if name not in self._tables:
+            fields = MATRIX_REDUCE_FIELDS if name == 'matrix_reduces' else WINDOW_SIZE_FIELDS
+            columns = self.columns(name)
+            self._tables[name] = list(zip(*[columns[f].tolist() for f in fields]))
+        return self._tables[name]
+
+    @property
+    def matrix_reduces(self):
+        return self.table('matrix_reduces')
+
+    @property
+    def window_sizes(self):
+        return self.table('window_sizes')
+
     #########################
 
     def dump_decodes(self):
@@ -64,43 +123,54 @@ class ProcStats():
 
     #########################
 
+    # Inserts and their decodes flattened into arrays, in recorded order
+    def decode_arrays(self):
+        if 'decode_arrays' not in self._memo:
+            itimes = numpy.array([t for (t, _, _) in self.message_inserts], dtype=numpy.float64)
+            pids = numpy.array([pid for (_, _, pid) in self.message_inserts], dtype=numpy.int64)
+            decodes = [self.message_decodes.get(pid, []) for (_, _, pid) in self.message_inserts]
+
+            # Number of decodes of each insert, and the insert index, time
+            # and node id of each decode
+            counts = numpy.array([len(d) for d in decodes], dtype=numpy.int64)
+            index = numpy.repeat(numpy.arange(len(decodes)), counts)
+            flat = numpy.array([e for d in decodes for e in d], dtype=numpy.float64).reshape(-1, 2)
+            dtimes = flat[:, 0]
+            dnids = flat[:, 1].astype(numpy.int64)
+
+            self._memo['decode_arrays'] = (itimes, pids, counts, index, dtimes, dnids)
+
+        return self._memo['decode_arrays']
+
     def compute_delays(self):
-        delay_min = []
-        delay_max = []
-        delay_avg = []
+        if 'delays' not in self._memo:
+            (itimes, _, counts, index, dtimes, _) = self.decode_arrays()
 
-        # For each inserted message
-        for (itime, _, pid) in self.message_inserts:
-            # If it was decoded
-            if pid in self.message_decodes and len(self.message_decodes[pid]) > 0:
-                # Collect the delays to decoding
-                delays = [ (dtime - itime) for (dtime, _) in self.message_decodes[pid] ]
-                # Add it to our min, max, avg tables
-                delay_min.append( delays[0] )
-                delay_max.append( delays[-1] )
-                delay_avg.append( sum(delays) / float(len(delays)) )
+            # Delays to decoding, grouped by insert
+            delays = dtimes - itimes[index]
+            decoded = counts > 0
+            starts = (numpy.cumsum(counts) - counts)[decoded]
+
+            # First, last and average delay of each decoded insert
+            delay_min = delays[starts]
+            delay_max = delays[starts + counts[decoded] - 1]
+            delay_avg = numpy.add.reduceat(delays, starts) / counts[decoded] if len(starts) > 0 else delays[:0]
 
-        return (delay_min, delay_max, delay_avg)
+            self._memo['delays'] = (delay_min, delay_max, delay_avg)
+
+        return self._memo['delays']
 
     def compute_pdecodes(self):
-        times = []
-        pids = []
-        pdecode = []
-
-        # For each inserted message
-        for (time, _, pid) in self.message_inserts:
-            times.append(time)
-            pids.append(pid)
-            # If the message was decoded
-            if pid in self.message_decodes and len(self.message_decodes[pid]) > 0:
-                # Calculate the percent of other nodes that decoded it
-                pdecode.append( 100.0 * \
-                    (float((len(self.message_decodes[pid]))) / \
-                    float(self.simParams['SIM_NUM_PEERS']-1-self.simParams['SIM_NUM_EVIL_PEERS'])))
-            else:
-                pdecode.append(0.0)
+        if 'pdecodes' not in self._memo:
+            (itimes, pids, counts, _, _, _) = self.decode_arrays()
 
-        return (times, pids, pdecode)
+            # Percent of the other cooperative nodes that decoded each insert
+            pdecode = 100.0 * counts / \
+                float(self.simParams['SIM_NUM_PEERS']-1-self.simParams['SIM_NUM_EVIL_PEERS'])
+
+            self._memo['pdecodes'] = (itimes, pids, pdecode)
+
+        return self._memo['pdecodes']
 
     def compute_avg_delay(self):
         (_, _, delay_avg) = self.compute_delays()
@@ -110,6 +180,10 @@ class ProcStats():
         (_, _, pdecode) = self.compute_pdecodes()
         return (numpy.mean(pdecode), ci_95(pdecode))
 
+    # Per-simulation results the aggregate plots need, as plain JSON types
+    def summary(self):
+        return summary_metrics(self.simParams, self.message_inserts, self.message_decodes)
+
     #########################
 
     def __str__(self):
@@ -133,11 +207,12 @@ class ProcStats():
 
 
 if __name__ == "__main__":
+    simsToProcess = data_files(sys.argv[2:])
+
     if len(sys.argv) < 2:
         print("Usage: %s <simulation data file>" % sys.argv[0])
         sys.exit(1)
 
-
     elif len(simsToProcess) > 1:
         statsProcList = [ StatsProcess(p) for p in simsToProcess ]
 
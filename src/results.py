@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+import json
+import time
+
+# Parameters that do not change simulation results, left out of the params
+# hash so that renaming or re-logging a simulation does not rerun it
+RESULTS_IGNORED_PARAMS = ['NAME', 'DESC', 'PRINT_LOG', 'LOG_EVENTS', 'LOG_STREAM', 'LOG_FORMAT', \
+                          'LOG_TYPES', 'LOG_SAMPLE', 'STATS_FORMAT', 'PROFILE', 'CHECKPOINT_INTERVAL', \
+                          'CHECKPOINT_WARMUP', 'GOSSIP_SOLVER']
+
+RESULTS_DB_PATH = "data/results.db"
+
+def params_hash(simParams):
+    params = dict((k, v) for (k, v) in simParams.items() if k not in RESULTS_IGNORED_PARAMS)
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+class Results_DB():
+    # Sweep results store, with a row per simulation keyed by params hash
+    def __init__(self, path=RESULTS_DB_PATH):
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS simulations (
+                            params_hash TEXT PRIMARY KEY,
+                            name TEXT,
+                            params TEXT,
+                            status TEXT,
+                            data_path TEXT,
+                            log_path TEXT,
+                            round_finished INTEGER,
+                            time_elapsed REAL,
+                            time_finished REAL,
+                            time_updated REAL,
+                            num_inserts INTEGER,
+                            avg_pdecode REAL,
+                            ci_pdecode REAL,
+                            avg_delay REAL,
+                            ci_delay REAL,
+                            summary TEXT)""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def status(self, simParams):
+        row = self.db.execute("SELECT status FROM simulations WHERE params_hash = ?", \
+                              (params_hash(simParams),)).fetchone()
+        return row[0] if row is not None else None
+
+    def finished(self, simParams):
+        return self.status(simParams) == "finished"
+
+    def interrupted(self):
+        # Flag the simulations a previous sweep left running, which did not
+        # finish, and are rerun like any unfinished simulation
+        self.db.execute("UPDATE simulations SET status = 'interrupted', time_updated = ? WHERE status = 'running'", \
+                        (time.time(),))
+        self.db.commit()
+
+    def started(self, simParams):
+        # Record a simulation as running, until it finishes
+        self.db.execute("""INSERT OR REPLACE INTO simulations (params_hash, name, params, status, time_updated)
+                           VALUES (?, ?, ?, 'running', ?)""", \
+                        (params_hash(simParams), simParams['NAME'], json.dumps(simParams), time.time()))
+        self.db.commit()
+
+    def rename(self, simParams):
+        # Keep the name and parameters of a finished simulation up to date with
+        # its sweep, without rerunning it
+        self.db.execute("UPDATE simulations SET name = ?, params = ? WHERE params_hash = ?", \
+                        (simParams['NAME'], json.dumps(simParams), params_hash(simParams)))
+        self.db.commit()
+
+    def finish(self, simParams, dataPath, logPath, summary):
+        self.db.execute("""INSERT OR REPLACE INTO simulations VALUES
+                           (?, ?, ?, 'finished', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", \
+                        (params_hash(simParams), simParams['NAME'], json.dumps(simParams), dataPath, logPath, \
+                         summary['round_finished'], summary['time_elapsed'], summary['time_finished'], time.time(), \
+                         summary['num_inserts'], summary['avg_pdecode'][0], summary['avg_pdecode'][1], \
+                         summary['avg_delay'][0], summary['avg_delay'][1], json.dumps(summary)))
+        self.db.commit()
+
+    def summaries(self, namePrefix=""):
+        # Summaries of the finished simulations whose name starts with namePrefix
+        rows = self.db.execute("""SELECT params, summary FROM simulations
+                                  WHERE status = 'finished' AND substr(name, 1, length(?)) = ?
+                                  ORDER BY name""", (namePrefix, namePrefix)).fetchall()
+
+        summaries = []
+        for (params, summary) in rows:
+            summary = json.loads(summary)
+            summary['simParams'] = json.loads(params)
+            summaries.append(summary)
+
+        return summaries
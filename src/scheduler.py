@@ -0,0 +1,114 @@
+import heapq
+import math
+
+from network import rng_stream
+
+# Event kinds
+EVENT_DELIVER = 0
+EVENT_ACTIVATE = 1
+
+class Link_Mailbox():
+    # Stands in for a peer's mailbox on the network, sending gossip put into
+    # it over the link from its source to the peer
+    __slots__ = ('scheduler', 'nid', 'mailbox')
+
+    def __init__(self, scheduler, nid, mailbox):
+        self.scheduler = scheduler
+        self.nid = nid
+        self.mailbox = mailbox
+
+    def put(self, item):
+        self.scheduler.send(item[0], self.nid, self.mailbox, item)
+
+class Event_Scheduler():
+    # Discrete-event scheduler of peer activations and gossip deliveries, in
+    # units of rounds. Each round, every peer that is due activates once at
+    # a random time within the round. Gossip arrives after the link's latency
+    # and the transmission time of the gossip queued on the link before it,
+    # and is processed by the destination at its next activation. A peer
+    # processing received gossip sends its own gossip after its processing
+    # cost, and skips activating in the rounds it is still busy.
+
+    def __init__(self, simParams):
+        self.simParams = simParams
+
+        # Link latencies in rounds, drawn once per link between the minimum
+        # and maximum latency
+        self.latency_min = simParams['LINK_LATENCY_MIN']
+        self.latency_max = simParams['LINK_LATENCY_MAX']
+        self.latency = {}
+        # Link bandwidth in linear combinations per round, or None for
+        # unlimited, and the time each link is busy transmitting until
+        self.bandwidth = simParams['LINK_BANDWIDTH']
+        self.busy = {}
+        # Processing cost in rounds per received gossip
+        self.process_cost = simParams['PEER_PROCESS_COST']
+
+        # Activation times and link latencies are drawn from their own random
+        # number generator, leaving the peers' draws to them, and derived from
+        # the seed so they are not the same draws as the peers'
+        self.rng = rng_stream(simParams['SEED'], "scheduler")
+
+        # Heap of events (time, sequence number, kind, target, item)
+        self.events = []
+        self.seq = 0
+        # Round of each peer's last activation
+        self.last_round = {}
+        # Peers that never need activating, and drop their gossip
+        self.idle = set()
+        # Time the activating peer sends its gossip at
+        self.send_time = 0.0
+
+    def schedule(self, t, kind, target, item):
+        heapq.heappush(self.events, (t, self.seq, kind, target, item))
+        self.seq += 1
+
+    def mailbox(self, nid, mailbox):
+        return Link_Mailbox(self, nid, mailbox)
+
+    def add_peers(self, peers):
+        for peer in peers:
+            if getattr(peer, 'idle', False):
+                self.idle.add(peer.nid)
+                continue
+            self.last_round[peer.nid] = -1
+            self.schedule(self.rng.random(), EVENT_ACTIVATE, peer, None)
+
+    def link_latency(self, src, dst):
+        if self.latency_max <= self.latency_min:
+            return self.latency_min
+        if (src, dst) not in self.latency:
+            self.latency[(src, dst)] = self.rng.uniform(self.latency_min, self.latency_max)
+        return self.latency[(src, dst)]
+
+    def send(self, src, dst, mailbox, item):
+        if dst in self.idle:
+            return
+
+        departure = self.send_time
+        # Transmit after the gossip queued on the link before it
+        if self.bandwidth is not None:
+            departure = max(departure, self.busy.get((src, dst), 0.0)) + len(item[1]) / float(self.bandwidth)
+            self.busy[(src, dst)] = departure
+
+        self.schedule(departure + self.link_latency(src, dst), EVENT_DELIVER, mailbox, item)
+
+    def simulate(self, rnd):
+        # Handle the events of round "rnd"
+        while len(self.events) > 0 and self.events[0][0] < rnd + 1:
+            (t, _, kind, target, item) = heapq.heappop(self.events)
+
+            if kind == EVENT_DELIVER:
+                target.put(item)
+                continue
+
+            # Activate the peer, ticking it over the rounds since its last
+            # activation
+            peer = target
+            cost = self.process_cost * len(peer.mailbox)
+            self.send_time = t + cost
+            peer.simulate(rnd, rnd - self.last_round[peer.nid])
+            self.last_round[peer.nid] = rnd
+
+            # Activate it again once it is done processing
+            self.schedule(rnd + max(1, int(math.ceil(cost))) + self.rng.random(), EVENT_ACTIVATE, peer, None)
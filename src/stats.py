@@ -1,29 +1,194 @@
 import json
+import math
+import array
+import struct
+import sys
 import os
 
+from timeit import default_timer
+
+# Fields of the per-peer, per-round statistics
+MATRIX_REDUCE_FIELDS = ["time", "nid", "numrows", "numcols", "numsolved"]
+WINDOW_SIZE_FIELDS = ["time", "nid", "solved_size", "gossip_size"]
+
+# Columnar data file magic, followed by a little-endian uint64 header length,
+# a JSON header, and the typed columns, each aligned to 8 bytes
+STATS_COLUMNAR_MAGIC = b"NCGABCOL"
+
+# Mean of the values "x", NaN if there are none
+def mean(x):
+    return sum(x) / float(len(x)) if len(x) > 0 else float('nan')
+
+# Half width of the 95% confidence interval of the mean of the values "x"
+def ci_95(x):
+    if len(x) == 0:
+        return float('nan')
+    m = mean(x)
+    return 1.96*math.sqrt(sum((v - m)**2 for v in x) / len(x))/math.sqrt(len(x))
+
+# Summary metrics of a simulation from its inserts and decodes, shared by the
+# simulator and ProcStats
+def summary_metrics(simParams, message_inserts, message_decodes):
+    numPeers = simParams['SIM_NUM_PEERS'] - 1 - simParams['SIM_NUM_EVIL_PEERS']
+
+    pdecode = []
+    delay_min = []
+    delay_max = []
+    delay_avg = []
+    for (itime, _, pid) in message_inserts:
+        decodes = message_decodes.get(pid, [])
+        pdecode.append(100.0 * len(decodes) / float(numPeers))
+        if len(decodes) > 0:
+            delays = [ (dtime - itime) for (dtime, _) in decodes ]
+            delay_min.append(delays[0])
+            delay_max.append(delays[-1])
+            delay_avg.append(sum(delays) / float(len(delays)))
+
+    return {'simParams': simParams,
+            'num_inserts': len(message_inserts),
+            'avg_pdecode': [mean(pdecode), ci_95(pdecode)],
+            'avg_delay': [mean(delay_avg), ci_95(delay_avg)],
+            'avg_delay_min': mean(delay_min),
+            'avg_delay_max': mean(delay_max)}
+
+class Stats_Columns():
+    # Typed array per field, appended a row at a time
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [array.array('i') for _ in fields]
+
+    def append(self, row):
+        for (column, value) in zip(self.columns, row):
+            column.append(value)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+# Phases of simulating a peer, in the order they run each round
+PROFILE_PHASES = ["tick", "track", "drain", "build", "solve", "fill", "send"]
+
+class Stats_Profile():
+    # Seconds spent in each phase of simulating the peers per round, and
+    # counters of the matrices reduced
+    def __init__(self):
+        self.seconds = dict((phase, array.array('d')) for phase in PROFILE_PHASES)
+        self.counters = {'reduces': 0, 'reduces_solved': 0, 'reduces_skipped': 0, 'numrows': 0, 'numcols': 0, \
+                         'numsolved': 0, 'max_numrows': 0, 'max_numcols': 0, 'max_numsolved': 0}
+        self.rnd = 0
+        self.last = 0.0
+
+    def start(self, rnd):
+        self.rnd = rnd
+        self.last = default_timer()
+
+    # Charge the time since the last lap to "phase" of the current round
+    def lap(self, phase):
+        now = default_timer()
+        column = self.seconds[phase]
+        while len(column) <= self.rnd:
+            column.append(0.0)
+        column[self.rnd] += now - self.last
+        self.last = now
+
+    def matrix_reduce(self, numrows, numcols, numsolved, skipped):
+        c = self.counters
+        c['reduces'] += 1
+        c['reduces_solved'] += 1 if numsolved > 0 else 0
+        c['reduces_skipped'] += 1 if skipped else 0
+        c['numrows'] += numrows
+        c['numcols'] += numcols
+        c['numsolved'] += numsolved
+        c['max_numrows'] = max(c['max_numrows'], numrows)
+        c['max_numcols'] = max(c['max_numcols'], numcols)
+        c['max_numsolved'] = max(c['max_numsolved'], numsolved)
+
+    def dump(self, path):
+        numRounds = max(len(column) for column in self.seconds.values())
+        seconds = dict((phase, list(column) + [0.0]*(numRounds - len(column))) for (phase, column) in self.seconds.items())
+
+        f = open(path, "w")
+        data = {'phases': PROFILE_PHASES,
+                'total_seconds': dict((phase, sum(column)) for (phase, column) in seconds.items()),
+                'round_seconds': seconds,
+                'counters': self.counters}
+        f.write(json.dumps(data))
+        f.close()
+
 class Stats():
     def __init__(self, simParams, simEventStop):
+        # Capture the per-round statistics in typed columns instead of lists
+        # of tuples
+        self.columnar = simParams['STATS_FORMAT'] == "columnar"
+
         # Statistics collected
         self._message_inserts = []
         self._message_decodes = {}
-        self._matrix_reduces = []
-        self._window_sizes = []
+        self._matrix_reduces = Stats_Columns(MATRIX_REDUCE_FIELDS) if self.columnar else []
+        self._window_sizes = Stats_Columns(WINDOW_SIZE_FIELDS) if self.columnar else []
+        self._reduces_skipped = 0
+        # Numbers of decodes and inserts at the start of the round, for
+        # checking the warmup and duration the same for all peers of a round,
+        # or None to check them as they happen
+        self._round_counts = None
         self._last_message_exists = {}
+        # Pids of the inserted messages, which windows count references to
+        self._message_tracked = set()
         self._round_finished = 0
         self._time_elapsed = -1.0
         self._time_finished = -1.0
 
+        # Per-phase timings of the peers, when profiling
+        self.profile = Stats_Profile() if simParams['PROFILE'] else None
+
         # Simulation parameters
         self.simParams = simParams
 
         self.simEventStop = simEventStop
 
+    # The stop event belongs to the running simulation, and is handed to a
+    # restored checkpoint
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['simEventStop'] = None
+        return state
+
     #########################
 
-    def message_track(self, rnd, decoded_objects, gossip_objects):
-        if len(self._message_decodes) < self.simParams['SIM_WARMUP_DECODES']:
-            return
-        if len(self._message_inserts) < self.simParams['SIM_DURATION_INSERTS']:
+    # Check the warmup and duration against the numbers of decodes and
+    # inserts at the start of each round
+    def round_started(self):
+        self._round_counts = (len(self._message_decodes), len(self._message_inserts))
+
+    def num_decodes(self):
+        return len(self._message_decodes) if self._round_counts is None else self._round_counts[0]
+
+    def num_inserts(self):
+        return len(self._message_inserts) if self._round_counts is None else self._round_counts[1]
+
+    # Check whether enough messages were decoded to start inserting tracked
+    # messages
+    def warmed_up(self):
+        return self.num_decodes() >= self.simParams['SIM_WARMUP_DECODES']
+
+    # Check whether the inserted messages are being tracked
+    def message_tracking(self):
+        if not self.warmed_up():
+            return False
+        if self.num_inserts() < self.simParams['SIM_DURATION_INSERTS']:
+            return False
+        return True
+
+    # Pids of the inserted messages being tracked
+    def tracked_pids(self):
+        return self._message_tracked
+
+    # Record whether any inserted message "exists" in a peer, or in the whole
+    # network, in round "rnd"
+    def message_track(self, rnd, exists):
+        if not self.message_tracking():
             return
 
         # If the last message disappeared in the previous round, signal
@@ -36,32 +201,24 @@ class Stats():
         elif rnd in self._last_message_exists and self._last_message_exists[rnd] == True:
             return
 
-        # Look for all messages inserted inside peers on the network
-        for (_, _, last_pid) in self._message_inserts:
-            # Look for the inserted message in the decoded objects
-            for p in decoded_objects:
-                if p.pid == last_pid:
-                    self._last_message_exists[rnd] = True
-                    return
-            # Look for the inserted message in the gossip objects
-            for lc in gossip_objects:
-                for p in lc.messages:
-                    if p.pid == last_pid:
-                        self._last_message_exists[rnd] = True
-                        return
-
-        self._last_message_exists[rnd] = False
+        # Checking the peers of a round the same, a message exists if it
+        # exists in any of them, not just the last one simulated
+        if self._round_counts is not None:
+            exists = exists or self._last_message_exists.get(rnd, False)
+
+        self._last_message_exists[rnd] = exists
 
     # Record inserting message "pid"
     def message_insert(self, rnd, nid, pid):
-        if len(self._message_decodes) < self.simParams['SIM_WARMUP_DECODES']:
+        if not self.warmed_up():
             return
 
         # If we have already collected our simulation number of inserts
-        if len(self._message_inserts) >= self.simParams['SIM_DURATION_INSERTS']:
+        if self.num_inserts() >= self.simParams['SIM_DURATION_INSERTS']:
             return
 
         self._message_inserts.append( (rnd, nid, pid) )
+        self._message_tracked.add(pid)
 
     # Record decoding message "pid"
     def message_decode(self, rnd, nid, pid):
@@ -75,9 +232,14 @@ class Stats():
 
         self._message_decodes[pid].append( (rnd, nid) )
 
-    # Record reducing "numrows" x "numcols" matrix, yielding "numsolved" new solutions
-    def matrix_reduce(self, rnd, nid, numrows, numcols, numsolved):
+    # Record reducing "numrows" x "numcols" matrix, yielding "numsolved" new
+    # solutions, or skipping the reduce as nothing changed since the last one
+    def matrix_reduce(self, rnd, nid, numrows, numcols, numsolved, skipped=False):
         self._matrix_reduces.append( (rnd, nid, numrows, numcols, numsolved) )
+        if skipped:
+            self._reduces_skipped += 1
+        if self.profile is not None:
+            self.profile.matrix_reduce(numrows, numcols, numsolved, skipped)
 
     # Record solved and gossip window sizes
     def window_size(self, rnd, nid, solved_size, gossip_size):
@@ -97,6 +259,15 @@ class Stats():
 
     #########################
 
+    # Summary metrics of the simulation, and its run
+    def summary(self):
+        summary = summary_metrics(self.simParams, self._message_inserts, self._message_decodes)
+        summary.update({'reduce_skip_rate': self._reduces_skipped / float(max(len(self._matrix_reduces), 1)),
+                        'round_finished': self._round_finished,
+                        'time_elapsed': self._time_elapsed,
+                        'time_finished': self._time_finished})
+        return summary
+
     def dump(self):
         i = 0
         while True:
@@ -105,12 +276,21 @@ class Stats():
                 break
             i += 1
 
+        # Write the profile next to the data file
+        if self.profile is not None:
+            self.profile.dump(path + ".profile")
+
+        if self.columnar:
+            self.dump_columnar(path)
+            return path
+
         f = open(path, "w")
         data = {'simParams': self.simParams,
                 'message_inserts': self._message_inserts,
                 'message_decodes': self._message_decodes,
                 'matrix_reduces': self._matrix_reduces,
                 'window_sizes': self._window_sizes,
+                'reduces_skipped': self._reduces_skipped,
                 'round_finished': self._round_finished,
                 'time_elapsed': self._time_elapsed,
                 'time_finished': self._time_finished}
@@ -119,3 +299,37 @@ class Stats():
 
         return path
 
+    def dump_columnar(self, path):
+        # Lay out the columns after the header, recording their offset
+        # relative to the first column, length and NumPy dtype
+        columns = {}
+        chunks = []
+        offset = 0
+        for (name, table) in [('matrix_reduces', self._matrix_reduces), ('window_sizes', self._window_sizes)]:
+            columns[name] = {}
+            for (field, column) in zip(table.fields, table.columns):
+                dtype = ("<" if sys.byteorder == "little" else ">") + "i%d" % column.itemsize
+                columns[name][field] = (offset, len(column), dtype)
+                chunk = column.tobytes()
+                chunks.append(chunk + b"\0"*(-len(chunk) % 8))
+                offset += len(chunks[-1])
+
+        header = {'simParams': self.simParams,
+                  'message_inserts': self._message_inserts,
+                  'message_decodes': self._message_decodes,
+                  'columns': columns,
+                  'reduces_skipped': self._reduces_skipped,
+                  'round_finished': self._round_finished,
+                  'time_elapsed': self._time_elapsed,
+                  'time_finished': self._time_finished}
+        header = json.dumps(header).encode('utf-8')
+        header += b" "*(-(len(STATS_COLUMNAR_MAGIC) + 8 + len(header)) % 8)
+
+        f = open(path, "wb")
+        f.write(STATS_COLUMNAR_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for chunk in chunks:
+            f.write(chunk)
+        f.close()
+
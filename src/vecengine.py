@@ -0,0 +1,426 @@
+import numpy
+
+from window import *
+
+def grow(a, n):
+    # Grow array a to hold at least n entries along its first axis
+    if n <= len(a):
+        return a
+    b = numpy.zeros((max(n, 2*len(a)),) + a.shape[1:], dtype=a.dtype)
+    b[:len(a)] = a
+    return b
+
+def owner_blocks(owners, num_peers):
+    # Stable order of entries grouped by owner, with each owner's block
+    # start and entry count
+    order = numpy.argsort(owners, kind='stable')
+    counts = numpy.bincount(owners, minlength=num_peers)
+    starts = numpy.cumsum(counts) - counts
+    return (order, starts, counts)
+
+def sample_distinct(rng, num_rows, m, n):
+    # n distinct random integers in [0, m) for each row, in sorted order.
+    # Draws with replacement and redraws the duplicates until there are
+    # none, which makes every n-subset equally likely, in O(num_rows*n)
+    # memory. For n past half of m, samples the complement instead.
+    if 2*n > m:
+        keep = numpy.ones((num_rows, m), dtype=bool)
+        excluded = sample_distinct(rng, num_rows, m, m - n)
+        keep[numpy.arange(num_rows)[:, None], excluded] = False
+        return numpy.nonzero(keep)[1].reshape(num_rows, n)
+
+    samples = rng.integers(0, m, size=(num_rows, n), dtype=numpy.int32)
+    samples.sort(axis=1)
+    # Only rows that had duplicates need redrawing and sorting again
+    rows = numpy.arange(num_rows)
+    while len(rows) > 0:
+        dup = samples[rows, 1:] == samples[rows, :-1]
+        redraw = dup.any(axis=1)
+        rows = rows[redraw]
+        dup = dup[redraw]
+        block = samples[rows]
+        block[:, 1:][dup] = rng.integers(0, m, size=int(dup.sum()), dtype=numpy.int32)
+        block.sort(axis=1)
+        samples[rows] = block
+
+    return samples
+
+class Vector_Engine():
+    # Simulates all cooperative peers of the network at once. The Decoded and
+    # Gossip Windows of every peer are kept in flat NumPy arrays of (owner,
+    # pid, TTL) entries, and each round is advanced in batched operations
+    # over the whole network: TTL decrement and expiry, insert scheduling,
+    # dummy message fill, destination selection and gossip coding. Only
+    # solving stays per peer, with an Incremental_Decoder that is fed only the
+    # gossip that has undecoded messages for that peer.
+    #
+    # Messages and linear combinations get sequential pids. Gossip sent in a
+    # round is received in the next round, and only join, insert, decode and
+    # finish events are logged, to keep the log bounded with thousands of
+    # peers. Stats are recorded in the same format as Peer.
+
+    def __init__(self, simLog, simStats, simParams):
+        if simParams['SIM_NUM_EVIL_PEERS'] > 0:
+            raise ValueError("vector engine does not simulate evil peers")
+
+        # Log, Stats handles
+        self.simLog = simLog
+        self.simStats = simStats
+        # Simulation parameters
+        self.simParams = simParams
+
+        self.num_peers = simParams['SIM_NUM_PEERS']
+        self.code_size = simParams['CODE_SIZE']
+        self.rng = numpy.random.default_rng(simParams['SEED'])
+
+        # Inserting peer of each message by pid, -1 for dummy messages
+        self.msg_nid = numpy.zeros(1024, dtype=numpy.int64)
+        self.num_msgs = 0
+
+        # Decoded Windows, live entries of (owner, pid, TTL)
+        self.dec_owner = numpy.zeros(0, dtype=numpy.int64)
+        self.dec_pid = numpy.zeros(0, dtype=numpy.int64)
+        self.dec_ttl = numpy.zeros(0, dtype=numpy.int64)
+        # Sorted (owner << 32 | pid) keys of live and expired decoded messages,
+        # pruned of messages no longer anywhere on the network
+        self.known = numpy.zeros(0, dtype=numpy.int64)
+        # Decoded Window sizes, live and expired, per peer
+        self.known_count = numpy.zeros(self.num_peers, dtype=numpy.int64)
+
+        # Linear combinations by sorted pid, with -1 padded message pids and
+        # coefficients
+        self.lc_id = numpy.zeros(0, dtype=numpy.int64)
+        self.lc_pids = numpy.zeros((0, self.code_size), dtype=numpy.int64)
+        self.lc_coefs = numpy.zeros((0, self.code_size), dtype=numpy.int64)
+        self.num_lcs = 0
+
+        # Gossip Windows, live entries of (owner, linear combination pid, TTL)
+        # and whether the entry was added to the owner's decoder
+        self.gos_owner = numpy.zeros(0, dtype=numpy.int64)
+        self.gos_lc = numpy.zeros(0, dtype=numpy.int64)
+        self.gos_ttl = numpy.zeros(0, dtype=numpy.int64)
+        self.gos_decoder = numpy.zeros(0, dtype=bool)
+
+        # Gossip in flight, received next round: (destination, linear
+        # combination pid, source)
+        self.inbox_dst = numpy.zeros(0, dtype=numpy.int64)
+        self.inbox_lc = numpy.zeros(0, dtype=numpy.int64)
+        self.inbox_src = numpy.zeros(0, dtype=numpy.int64)
+
+        # Per peer incremental decoders, created on the first useful gossip,
+        # and the pids each peer decoded since its last solve
+        self.decoders = [None] * self.num_peers
+        self.new_decoded = [[] for _ in range(self.num_peers)]
+
+        # Choose initial random insert message timeouts
+        self.insert_timeout = self.rng.integers(0, int(simParams['CONTRIBUTE_INTERVAL']), \
+                                    size=self.num_peers, endpoint=True)
+
+        # Join the network
+        for nid in range(self.num_peers):
+            self.simLog.log(0, "join", nid, "")
+
+        # Initialize our windows with dummy messages
+        self.fill_dummies()
+
+    #########################
+
+    def new_messages(self, nids):
+        # Allocate pids for new messages inserted by nids
+        pids = numpy.arange(self.num_msgs, self.num_msgs + len(nids))
+        self.msg_nid = grow(self.msg_nid, self.num_msgs + len(nids))
+        self.msg_nid[pids] = nids
+        self.num_msgs += len(nids)
+        return pids
+
+    def add_decoded(self, owners, pids):
+        # Add messages to Decoded Windows, skipping messages already decoded
+        keys = (owners << 32) | pids
+        (keys, first) = numpy.unique(keys, return_index=True)
+        new = ~numpy.isin(keys, self.known, assume_unique=True)
+        (owners, pids, keys) = (owners[first][new], pids[first][new], keys[new])
+
+        self.dec_owner = numpy.concatenate((self.dec_owner, owners))
+        self.dec_pid = numpy.concatenate((self.dec_pid, pids))
+        self.dec_ttl = numpy.concatenate((self.dec_ttl, numpy.full(len(pids), self.simParams['TTL_DECODE'])))
+        self.known = numpy.insert(self.known, numpy.searchsorted(self.known, keys), keys)
+        self.known_count += numpy.bincount(owners, minlength=self.num_peers)
+
+        # Decoders project out the newly decoded messages on their next solve
+        for (nid, pid) in zip(owners.tolist(), pids.tolist()):
+            if self.decoders[nid] is not None:
+                self.new_decoded[nid].append(pid)
+
+        return (owners, pids)
+
+    def lc_rows(self, lc_pids):
+        return numpy.searchsorted(self.lc_id, lc_pids)
+
+    #########################
+
+    def tick(self):
+        # Decrement the TTL of every Decoded Window entry, dropping expired ones
+        self.dec_ttl -= 1
+        live = self.dec_ttl > 0
+        self.dec_owner = self.dec_owner[live]
+        self.dec_pid = self.dec_pid[live]
+        self.dec_ttl = self.dec_ttl[live]
+
+        # Decrement the TTL of every Gossip Window entry, dropping expired ones
+        self.gos_ttl -= 1
+        live = self.gos_ttl > 0
+        expired = numpy.nonzero(~live & self.gos_decoder)[0]
+        for (nid, lc_pid) in zip(self.gos_owner[expired].tolist(), self.gos_lc[expired].tolist()):
+            self.decoders[nid].remove(lc_pid)
+        self.gos_owner = self.gos_owner[live]
+        self.gos_lc = self.gos_lc[live]
+        self.gos_ttl = self.gos_ttl[live]
+        self.gos_decoder = self.gos_decoder[live]
+
+    def track(self, rnd):
+        # Keep track of the last tracked message disappearing
+        if not self.simStats.message_tracking():
+            return
+
+        tracked = numpy.fromiter(self.simStats.tracked_pids(), dtype=numpy.int64)
+        exists = numpy.isin(tracked, self.dec_pid).any() or \
+                 numpy.isin(tracked, self.lc_pids[self.lc_rows(self.gos_lc)]).any()
+        self.simStats.message_track(rnd, bool(exists))
+
+    def insert(self, rnd):
+        # Decrement our insert message timeout counters
+        self.insert_timeout = numpy.maximum(0, self.insert_timeout - 1)
+
+        # Introduce a new message at each peer whose insert timeout expired
+        nids = numpy.nonzero(self.insert_timeout == 0)[0]
+        (nids, pids) = self.add_decoded(nids, self.new_messages(nids))
+        for (nid, pid) in zip(nids.tolist(), pids.tolist()):
+            self.simLog.log(rnd, "insert", nid, "M%d/%04x" % (nid, pid))
+            self.simStats.message_insert(rnd, nid, pid)
+
+        # Choose new insert message timeouts
+        self.insert_timeout[nids] = int(self.simParams['CONTRIBUTE_INTERVAL'])
+
+    def receive(self):
+        if len(self.inbox_dst) == 0:
+            return
+
+        # Drop gossip already in the destination's Gossip Window
+        keys = (self.inbox_dst << 32) | self.inbox_lc
+        (keys, first) = numpy.unique(keys, return_index=True)
+        new = ~numpy.isin(keys, (self.gos_owner << 32) | self.gos_lc)
+        owners = self.inbox_dst[first][new]
+        lcs = self.inbox_lc[first][new]
+
+        # Find gossip with messages its destination has not decoded
+        rows = self.lc_rows(lcs)
+        pids = self.lc_pids[rows]
+        coefs = self.lc_coefs[rows]
+        undecoded = (pids >= 0) & (coefs != 0) & \
+                    ~numpy.isin((owners[:, None] << 32) | pids, self.known)
+        useful = undecoded.any(axis=1)
+
+        # Add it to the destination's decoder without the decoded messages
+        for i in numpy.nonzero(useful)[0].tolist():
+            nid = int(owners[i])
+            if self.decoders[nid] is None:
+                self.decoders[nid] = Incremental_Decoder()
+            m = undecoded[i]
+            self.decoders[nid].add(int(lcs[i]), pids[i][m].tolist(), coefs[i][m].tolist())
+
+        # Add the linear combinations to the Gossip Windows
+        self.gos_owner = numpy.concatenate((self.gos_owner, owners))
+        self.gos_lc = numpy.concatenate((self.gos_lc, lcs))
+        self.gos_ttl = numpy.concatenate((self.gos_ttl, numpy.full(len(lcs), self.simParams['TTL_GOSSIP'])))
+        self.gos_decoder = numpy.concatenate((self.gos_decoder, useful))
+
+        self.inbox_dst = self.inbox_dst[:0]
+        self.inbox_lc = self.inbox_lc[:0]
+        self.inbox_src = self.inbox_src[:0]
+
+    def solve(self, rnd):
+        gossip_sizes = numpy.bincount(self.gos_owner, minlength=self.num_peers)
+
+        solved_nids = []
+        solved_pids = []
+        for nid in range(self.num_peers):
+            decoder = self.decoders[nid]
+            num_undecoded = 0
+            num_solved = 0
+            skipped = False
+
+            # Try to solve some gossip
+            if decoder is not None:
+                solved = decoder.solve(self.new_decoded[nid])
+                self.new_decoded[nid] = []
+                num_undecoded = len(decoder.msg_refs)
+                num_solved = len(solved)
+                skipped = decoder.skipped
+                solved_nids += [nid] * num_solved
+                solved_pids += solved
+
+            # Record the reduce attempt, sized like the full decoding matrix
+            self.simStats.matrix_reduce(rnd, nid, int(self.known_count[nid] + gossip_sizes[nid]), \
+                                        int(self.known_count[nid]) + num_undecoded, num_solved, skipped)
+
+        # Add the decoded messages to our Decoded Windows
+        (nids, pids) = self.add_decoded(numpy.array(solved_nids, dtype=numpy.int64), \
+                                        numpy.array(solved_pids, dtype=numpy.int64))
+        for (nid, pid) in zip(nids.tolist(), pids.tolist()):
+            inserter = int(self.msg_nid[pid])
+            if inserter >= 0:
+                self.simLog.log(rnd, "decode", nid, "M%d/%04x" % (inserter, pid))
+                self.simStats.message_decode(rnd, nid, pid)
+            else:
+                self.simLog.log(rnd, "decode", nid, "R%04x" % pid)
+
+    def fill_dummies(self):
+        # Fill up Decoded Windows with dummy messages if they are short
+        live = numpy.bincount(self.dec_owner, minlength=self.num_peers)
+        need = numpy.maximum(0, self.code_size - live)
+        nids = numpy.repeat(numpy.arange(self.num_peers), need)
+        self.add_decoded(nids, self.new_messages(numpy.full(len(nids), -1)))
+
+    def send(self):
+        num_peers = self.num_peers
+        n = int(self.simParams['LOOKUP_PERCENT']*num_peers)
+        if n <= 0:
+            return
+
+        # Look up n random peers for every peer, sampling from the other
+        # peers' indices and skipping over its own index
+        dests = sample_distinct(self.rng, num_peers, num_peers - 1, n).astype(numpy.int64)
+        dests = dests + (dests >= numpy.arange(num_peers)[:, None])
+
+        srcs = numpy.repeat(numpy.arange(num_peers), n)
+        dests = dests.ravel()
+
+        # Code new-gossip or choose re-gossip for each destination
+        coded = self.rng.integers(0, 2, size=len(dests)).astype(bool)
+
+        (coded_lcs, coded_dests, coded_srcs) = self.code_gossip(srcs[coded], dests[coded], srcs[coded])
+        (re_lcs, re_dests, re_srcs) = self.choose_regossip(srcs[~coded], dests[~coded], srcs[~coded])
+
+        # Transmit to the destinations
+        self.inbox_dst = numpy.concatenate((coded_dests, re_dests))
+        self.inbox_lc = numpy.concatenate((coded_lcs, re_lcs))
+        self.inbox_src = numpy.concatenate((coded_srcs, re_srcs))
+
+    def code_gossip(self, owners, dests, srcs):
+        # Code RLCs of CODE_SIZE TTL weighted random choices without
+        # replacement from each owner's Decoded Window, by taking the largest
+        # log(u)/ttl keys
+        (order, starts, counts) = owner_blocks(self.dec_owner, self.num_peers)
+        width = max(int(counts.max()) if len(counts) > 0 else 0, 1)
+
+        entry_owner = self.dec_owner[order]
+        entry_pos = numpy.arange(len(order)) - starts[entry_owner]
+        ttls = numpy.zeros((self.num_peers, width))
+        ttls[entry_owner, entry_pos] = self.dec_ttl[order]
+        pids = numpy.full((self.num_peers, width), -1, dtype=numpy.int64)
+        pids[entry_owner, entry_pos] = self.dec_pid[order]
+
+        with numpy.errstate(divide='ignore'):
+            keys = numpy.log(self.rng.random((len(owners), width))) / ttls[owners]
+
+        k = min(self.code_size, width)
+        if k < width:
+            chosen = numpy.argpartition(-keys, k - 1, axis=1)[:, :k]
+        else:
+            chosen = numpy.tile(numpy.arange(width), (len(owners), 1))
+
+        lc_pids = numpy.full((len(owners), self.code_size), -1, dtype=numpy.int64)
+        lc_pids[:, :k] = pids[owners[:, None], chosen]
+        lc_pids[:, :k][ttls[owners[:, None], chosen] == 0] = -1
+        lc_coefs = self.rng.integers(0, 256, size=lc_pids.shape)
+        lc_coefs[lc_pids < 0] = 0
+
+        # Add them to the linear combination table
+        lcs = numpy.arange(self.num_lcs, self.num_lcs + len(owners))
+        self.num_lcs += len(owners)
+        self.lc_id = numpy.concatenate((self.lc_id, lcs))
+        self.lc_pids = numpy.concatenate((self.lc_pids, lc_pids))
+        self.lc_coefs = numpy.concatenate((self.lc_coefs, lc_coefs))
+
+        return (lcs, dests, srcs)
+
+    def choose_regossip(self, owners, dests, srcs):
+        # Choose a TTL weighted random linear combination from each owner's
+        # Gossip Window, by inverting the cumulative TTLs of its block
+        (order, starts, counts) = owner_blocks(self.gos_owner, self.num_peers)
+
+        # Owners with an empty Gossip Window send nothing
+        has = counts[owners] > 0
+        (owners, dests, srcs) = (owners[has], dests[has], srcs[has])
+
+        cumttl = numpy.cumsum(self.gos_ttl[order])
+        base = numpy.concatenate(([0], cumttl))[starts]
+        total = numpy.concatenate(([0], cumttl))[starts + counts] - base
+
+        target = base[owners] + self.rng.random(len(owners))*total[owners]
+        index = numpy.searchsorted(cumttl, target, side='right')
+        index = numpy.clip(index, starts[owners], starts[owners] + counts[owners] - 1)
+
+        return (self.gos_lc[order][index], dests, srcs)
+
+    def collect(self, rnd):
+        # Drop linear combinations no longer in any Gossip Window or in flight
+        referenced = numpy.union1d(self.gos_lc, self.inbox_lc)
+        if len(self.lc_id) > 2*len(referenced) + 1024:
+            keep = numpy.isin(self.lc_id, referenced, assume_unique=True)
+            self.lc_id = self.lc_id[keep]
+            self.lc_pids = self.lc_pids[keep]
+            self.lc_coefs = self.lc_coefs[keep]
+
+        # Prune decoded keys of messages that are no longer anywhere on the
+        # network, which can never be received again
+        if rnd % self.simParams['TTL_DECODE'] == 0:
+            alive = numpy.union1d(self.dec_pid, self.lc_pids[self.lc_rows(referenced)].ravel())
+            self.known = self.known[numpy.isin(self.known & 0xffffffff, alive)]
+
+    #########################
+
+    def simulate(self, rnd):
+        profile = self.simStats.profile
+        if profile is not None:
+            profile.start(rnd)
+
+        # Update the TTLs of our object windows
+        self.tick()
+        if profile is not None:
+            profile.lap("tick")
+
+        # Keep track of the last tracked message disappearing
+        self.track(rnd)
+        # Log our window sizes
+        gossip_sizes = numpy.bincount(self.gos_owner, minlength=self.num_peers)
+        for nid in range(self.num_peers):
+            self.simStats.window_size(rnd, nid, int(self.known_count[nid]), int(gossip_sizes[nid]))
+
+        # Introduce new messages
+        self.insert(rnd)
+        if profile is not None:
+            profile.lap("track")
+
+        # Process all received gossip
+        self.receive()
+        if profile is not None:
+            profile.lap("drain")
+
+        # Try to solve some gossip, and add the decoded messages to our
+        # Decoded Windows
+        self.solve(rnd)
+        if profile is not None:
+            profile.lap("solve")
+
+        # Fill up Decoded Windows with dummy messages if they are short
+        self.fill_dummies()
+        if profile is not None:
+            profile.lap("fill")
+
+        # Look up and transmit gossip to LOOKUP_PERCENT subset of peers
+        self.send()
+
+        self.collect(rnd)
+        if profile is not None:
+            profile.lap("send")
@@ -1,15 +1,121 @@
 import random
 import operator
+import itertools
+import bisect
+import threading
 import ctypes
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 ctypes.cdll.LoadLibrary("./ff.so")
 cff = ctypes.CDLL("./ff.so")
 
 # Pre-compute finite field tables
 cff.ff8_precompute()
-# Pre-allocate ctypes matrix for Gaussian Elimination
-Matrix = (ctypes.c_uint8 * (2048 * 2048))()
-# Pre-allocate ctypes solved indices array
-SolvedIndices = (ctypes.c_uint16 * (2048))()
+
+# Matrix solver context interface
+cff.matrix_ctx_alloc.restype = ctypes.c_void_p
+cff.matrix_ctx_alloc.argtypes = []
+cff.matrix_ctx_free.restype = None
+cff.matrix_ctx_free.argtypes = [ctypes.c_void_p]
+cff.matrix_ctx_load.restype = ctypes.POINTER(ctypes.c_uint8)
+cff.matrix_ctx_load.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+cff.matrix_ctx_solve.restype = ctypes.c_int
+cff.matrix_ctx_solve.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_int]
+cff.matrix_ctx_solve_batch.restype = ctypes.c_int
+cff.matrix_ctx_solve_batch.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int32), \
+                                       ctypes.POINTER(ctypes.c_int32), ctypes.POINTER(ctypes.c_uint32), \
+                                       ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint32), \
+                                       ctypes.POINTER(ctypes.c_int32)]
+
+# Python copies of the finite field multiplication and inverse tables
+FF_MUL = [bytes(r) for r in (ctypes.c_uint8 * 256 * 256).in_dll(cff, "ff8_mul_table")]
+FF_INV = [0] + [(ctypes.c_uint8 * 256 * 256).in_dll(cff, "ff8_div_table")[1][c] for c in range(1, 256)]
+
+class Matrix_Context():
+    # Solver context for Gaussian Elimination, holding a matrix buffer sized
+    # on demand. ctypes releases the GIL during the solve, so contexts of
+    # different threads can solve at the same time.
+
+    def __init__(self):
+        self.ctx = cff.matrix_ctx_alloc()
+        if not self.ctx:
+            raise MemoryError("allocating matrix context")
+        self.solved_indices = (ctypes.c_uint32 * 0)()
+
+    def __del__(self):
+        if self.ctx:
+            cff.matrix_ctx_free(self.ctx)
+            self.ctx = None
+
+    def load(self, num_rows, num_cols):
+        # Clear and return the matrix buffer for filling in
+        matrix = cff.matrix_ctx_load(self.ctx, num_rows, num_cols)
+        if not matrix and num_rows*num_cols > 0:
+            raise MemoryError("allocating %dx%d matrix" % (num_rows, num_cols))
+
+        if len(self.solved_indices) < num_cols:
+            self.solved_indices = (ctypes.c_uint32 * num_cols)()
+
+        return matrix
+
+    def solve(self, num_identity):
+        # rref the loaded matrix, returning the solved column indices after
+        # the leading identity columns
+        num_solved = cff.matrix_ctx_solve(self.ctx, self.solved_indices, num_identity)
+        return self.solved_indices[num_identity:num_solved]
+
+    def solve_batch(self, batch):
+        # rref a batch of matrices described by their sparse rows with one
+        # call, returning the solved column indices after the identity
+        # columns of each matrix
+        num_matrices = len(batch.dims) // 3
+        num_cols = sum(batch.dims[1::3])
+        if len(self.solved_indices) < num_cols:
+            self.solved_indices = (ctypes.c_uint32 * num_cols)()
+        num_solved = (ctypes.c_int32 * num_matrices)()
+
+        if cff.matrix_ctx_solve_batch(self.ctx, num_matrices, batch.buffer('dims', ctypes.c_int32), \
+                                      batch.buffer('row_nnz', ctypes.c_int32), batch.buffer('cols', ctypes.c_uint32), \
+                                      batch.buffer('coefs', ctypes.c_uint8), self.solved_indices, num_solved) < 0:
+            raise MemoryError("allocating batch of %d matrices" % num_matrices)
+
+        solved = []
+        offset = 0
+        for i in range(num_matrices):
+            solved.append(self.solved_indices[offset + batch.dims[3*i + 2]:offset + num_solved[i]])
+            offset += num_solved[i]
+
+        return solved
+
+# Windows of at least this many linear combinations map their columns with
+# NumPy, when it is available
+MATRIX_NUMPY_MIN_ROWS = 64
+
+class Matrix_Batch():
+    # Sparse description of a batch of matrices for the solver: the rows,
+    # columns and leading identity rows of each matrix, and the entries of
+    # the rows below the identity, one row after another
+    def __init__(self):
+        self.dims = array.array('i')
+        self.row_nnz = array.array('i')
+        self.cols = array.array('I')
+        self.coefs = bytearray()
+
+    def buffer(self, name, ctype):
+        data = getattr(self, name)
+        return (ctype * len(data)).from_buffer(data)
+
+MatrixContexts = threading.local()
+
+def matrix_context():
+    # Solver context of the current thread
+    if not hasattr(MatrixContexts, 'ctx'):
+        MatrixContexts.ctx = Matrix_Context()
+    return MatrixContexts.ctx
 
 def choose_weighted_random(scores):
     scores_cdf = []
@@ -28,37 +134,168 @@ def choose_weighted_random(scores):
 
     return index
 
-class Decoded_Window():
+def choose_weighted_buckets(scores, buckets, n, rng=random):
+    # Choose n objects without replacement from buckets of objects sharing a
+    # score, weighted by score. Makes the same choices with the same random
+    # draws as choose_weighted_random() over the objects in bucket order,
+    # while only visiting the buckets and the objects chosen.
+    counts = [len(objects) for objects in buckets]
+    buckets_cdf = list(itertools.accumulate(map(operator.mul, scores, counts)))
+
+    # Bucket and index of the objects chosen, in order
+    taken = []
+
+    chosen = []
+    for _ in range(n):
+        random_score = rng.random()*buckets_cdf[-1]
+
+        # First bucket whose running sum exceeds the random score, or the last
+        # non-empty bucket if rounding pushed the random score to the sum
+        b = bisect.bisect_right(buckets_cdf, random_score)
+        if b == len(buckets_cdf):
+            b = bisect.bisect_left(buckets_cdf, buckets_cdf[-1])
+
+        # First remaining object in the bucket whose running sum exceeds the
+        # random score, compared exactly
+        score = scores[b]
+        count = counts[b]
+        runningSum = buckets_cdf[b] - count*score
+        k = min(int((random_score - runningSum) // score), count - 1)
+        if runningSum + (k+1)*score <= random_score and k < count - 1:
+            k += 1
+        elif k > 0 and runningSum + k*score > random_score:
+            k -= 1
+
+        # Skip over the objects already chosen from this bucket
+        for (tb, i) in taken:
+            if tb == b and i <= k:
+                k += 1
+        bisect.insort(taken, (b, k))
+
+        chosen.append(buckets[b][k])
+        counts[b] = count - 1
+        buckets_cdf[b:] = [c - score for c in buckets_cdf[b:]]
+
+    return chosen
+
+class Timing_Wheel():
+    # Pids of a window's live objects by the tick they expire at, so a tick
+    # only visits the objects expiring on it
     def __init__(self):
-        self.window_live = []
-        self.window_expired = []
-        self.ttl = {}
+        self.ticks = 0
+        self.expiry = {}
+        self.buckets = {}
+        # Sorted ticks of the buckets
+        self.expiries = []
+
+    def add(self, pid, ttl):
+        expiry = self.ticks + max(ttl, 1)
+        self.expiry[pid] = expiry
+        if expiry not in self.buckets:
+            self.buckets[expiry] = []
+            bisect.insort(self.expiries, expiry)
+        self.buckets[expiry].append(pid)
+
+    def ttl(self, pid):
+        return self.expiry[pid] - self.ticks
+
+    def tick(self):
+        # Advance a tick, returning the pids whose TTL ran out
+        self.ticks += 1
+
+        # The bucket expiring now is the earliest one
+        if len(self.expiries) > 0 and self.expiries[0] == self.ticks:
+            del self.expiries[0]
+
+        pids = self.buckets.pop(self.ticks, [])
+        for pid in pids:
+            del self.expiry[pid]
+        return pids
+
+    def scored_buckets(self):
+        # TTLs of the buckets and their pids, in order of TTL and then of
+        # addition
+        return ([expiry - self.ticks for expiry in self.expiries], [self.buckets[expiry] for expiry in self.expiries])
+
+class Decoded_Window():
+    def __init__(self, expired_ttl=None, tracked=()):
+        # Live and expired objects by pid, in the order they were added
+        self.window_live = {}
+        self.window_expired = {}
+        # Rounds to remember expired objects, or None to remember them forever
+        self.expired_ttl = expired_ttl
+        # Pids of forgotten objects, not yet forgotten by the Gossip Window
+        self.forgotten = []
+        # Pids of tracked messages, and the live ones in our window
+        self.tracked = tracked
+        self.window_tracked = set()
+
+        # Timing wheel of the live pids, and pids by the tick they are
+        # forgotten at
+        self.wheel = Timing_Wheel()
+        self.forget_buckets = {}
+
+        # Number of objects added and forgotten, and the pids added since the
+        # Gossip Window's last matrix solve, or None when it does not follow
+        # them
+        self.generation = 0
+        self.added = None
 
     def add(self, p, ttl):
-        if p in self.window_live or p in self.window_expired:
+        if p.pid in self.window_live or p.pid in self.window_expired:
             return False
 
+        self.generation += 1
+        if self.added is not None:
+            self.added.append(p.pid)
+
         # Add it to our live window
-        self.window_live.append(p)
-        self.ttl[p.pid] = ttl
+        self.window_live[p.pid] = p
+        self.wheel.add(p.pid, ttl)
+
+        self.track(p)
 
         return True
 
+    def track(self, p):
+        # Count a live object that is tracked, or that started being tracked
+        # after it was added
+        if p.pid in self.tracked and p.pid in self.window_live:
+            self.window_tracked.add(p.pid)
+
+    def ttl(self, p):
+        return self.wheel.ttl(p.pid)
+
     def tick(self):
-        # Decrement the TTL for each object in the live window
-        for p in self.window_live[:]:
-            self.ttl[p.pid] -= 1
-            # Move the item to the expired window if it expired
-            if self.ttl[p.pid] <= 0:
-                del self.ttl[p.pid]
-                self.window_live.remove(p)
-                self.window_expired.append(p)
+        # Move the objects whose TTL ran out to the expired window
+        for pid in self.wheel.tick():
+            self.window_expired[pid] = self.window_live.pop(pid)
+
+            self.window_tracked.discard(pid)
+
+            if self.expired_ttl is not None:
+                self.forget_buckets.setdefault(self.wheel.ticks + self.expired_ttl, []).append(pid)
+
+        # Forget expired objects past their expired TTL
+        for pid in self.forget_buckets.pop(self.wheel.ticks, []):
+            del self.window_expired[pid]
+            self.forgotten.append(pid)
+            self.generation += 1
 
     def live_objects(self):
-        return self.window_live[:]
+        return list(self.window_live.values())
 
     def objects(self):
-        return self.window_live[:] + self.window_expired[:]
+        return list(self.window_live.values()) + list(self.window_expired.values())
+
+    def num_objects(self):
+        return len(self.window_live) + len(self.window_expired)
+
+    def num_live_objects(self):
+        return len(self.window_live)
+
+    def num_tracked(self):
+        return len(self.window_tracked)
 
     def choose_random_uniform(self, n):
         # Shuffle all live objects
@@ -68,147 +305,693 @@ class Decoded_Window():
         # Choose first n
         return choices[0:n]
 
-    def choose_random(self, n):
-        # Sort live objects by TTL
-        choices, scores = [list(t) for t in zip(*sorted([(m, self.ttl[m.pid]) for m in self.live_objects()], key=operator.itemgetter(1)))]
+    def choose_random(self, n, rng=random):
+        n = min(n, len(self.window_live))
 
-        n = min(n, len(choices))
-
-        # Choose n weighted random choices
-        chosen = []
-        for _ in range(n):
-            k = choose_weighted_random(scores)
-            chosen.append(choices[k])
-            del choices[k]
-            del scores[k]
+        # Choose n weighted random choices by TTL, from the live pids in order
+        # of TTL and then of addition
+        (scores, buckets) = self.wheel.scored_buckets()
 
-        return chosen
+        return [self.window_live[pid] for pid in choose_weighted_buckets(scores, buckets, n, rng)]
 
     def __str__(self):
         s = "Decoded Window\n"
-        for x in self.window_live:
-            s += "\t" + str(x) + " TTL: " + str(self.ttl[x.pid]) + "\n"
+        for x in self.live_objects():
+            s += "\t" + str(x) + " TTL: " + str(self.ttl(x)) + "\n"
         return s
 
-class Gossip_Window():
+class Incremental_Decoder():
+    # Basis rows are packed into Python integers, one byte per column, so
+    # that row operations run over whole rows at once. Columns hold both the
+    # undecoded message coefficients and the combination of live linear
+    # combinations each row was built from, which lets an expired linear
+    # combination be eliminated from the basis without rebuilding it.
+
     def __init__(self):
-        self.window_live = []
-        self.ttl = {}
+        # Reduced basis rows, pivot column -> packed row
+        self.rows = {}
+        # Column index -> message pid or linear combination pid
+        self.col_keys = {}
+        # Message pid -> column index, linear combination pid -> column index
+        self.msg_cols = {}
+        self.lc_cols = {}
+        # Free column indices and the packed row width
+        self.free_cols = []
+        self.width = 0
+        # Mask of the message columns in a packed row
+        self.msg_mask = 0
+        # Message pid -> number of live linear combinations referencing it
+        self.msg_refs = {}
+
+        # Live linear combinations, pid -> (message pids, coefficients)
+        self.live = {}
+        # Linear combinations waiting to be folded into the basis
+        self.pending = {}
+        # Live linear combinations that reduced to zero, but still have
+        # undecoded columns
+        self.redundant = {}
+        # Pids of decoded messages projected out of the basis -> number of
+        # live linear combinations referencing them
+        self.decoded = {}
+        # Redundant linear combinations need to be re-folded
+        self.refold = False
+
+        # Number of changes to the basis, the number at the last scan for
+        # solved columns and the columns it found, and whether the last solve
+        # skipped the scan
+        self.generation = 0
+        self.solved_generation = None
+        self.solved = set()
+        self.skipped = False
+
+    #########################
+
+    def _alloc_col(self, key):
+        if len(self.free_cols) > 0:
+            col = self.free_cols.pop()
+        else:
+            col = self.width
+            self.width += 1
+        self.col_keys[col] = key
+        return col
+
+    def _free_col(self, col):
+        del self.col_keys[col]
+        self.free_cols.append(col)
+
+    def _mul(self, row, c):
+        # row .* c
+        return int.from_bytes(row.to_bytes(self.width, 'little').translate(FF_MUL[c]), 'little')
+
+    def _coef(self, row, col):
+        return (row >> (8*col)) & 0xff
+
+    def _low_col(self, row):
+        # Index of the lowest nonzero column
+        return ((row & -row).bit_length() - 1) >> 3
+
+    #########################
+
+    def add(self, lc_pid, pids, coefs):
+        self.live[lc_pid] = (pids, coefs)
+        self.pending[lc_pid] = (pids, coefs)
+
+        # Allocate columns for its undecoded messages
+        for pid in set(pids):
+            if pid in self.decoded:
+                self.decoded[pid] += 1
+                continue
+            if pid not in self.msg_refs:
+                col = self._alloc_col(pid)
+                self.msg_cols[pid] = col
+                self.msg_mask |= 0xff << (8*col)
+                self.msg_refs[pid] = 0
+            self.msg_refs[pid] += 1
+
+    def remove(self, lc_pid):
+        (pids, _) = self.live.pop(lc_pid)
+
+        if lc_pid in self.pending:
+            del self.pending[lc_pid]
+        elif lc_pid in self.redundant:
+            del self.redundant[lc_pid]
+        elif lc_pid in self.lc_cols:
+            self._downdate(lc_pid)
+
+        # Free columns of messages no longer referenced by any live linear
+        # combination, which are zero in every basis row
+        for pid in set(pids):
+            if pid in self.decoded:
+                self.decoded[pid] -= 1
+            elif pid in self.msg_refs:
+                self.msg_refs[pid] -= 1
+                if self.msg_refs[pid] == 0:
+                    del self.msg_refs[pid]
+                    self._free_msg_col(pid)
+
+    def _free_msg_col(self, pid):
+        col = self.msg_cols.pop(pid)
+        self.msg_mask &= ~(0xff << (8*col))
+        self._free_col(col)
+
+    #########################
+
+    def _fold(self, row, origin):
+        self.generation += 1
+
+        # Eliminate existing pivots from the new row
+        for p, prow in self.rows.items():
+            c = (row >> (8*p)) & 0xff
+            if c:
+                row ^= self._mul(prow, c)
+
+        # Row is linearly dependent on the basis
+        if row & self.msg_mask == 0:
+            return self._dependency(row, origin)
+
+        # Normalize the new row to a pivot of 1
+        p = self._low_col(row & self.msg_mask)
+        row = self._mul(row, FF_INV[self._coef(row, p)])
+
+        # Eliminate the new pivot from the other rows
+        shift = 8*p
+        for q, qrow in self.rows.items():
+            c = (qrow >> shift) & 0xff
+            if c:
+                self.rows[q] = qrow ^ self._mul(row, c)
+
+        self.rows[p] = row
+
+        return None
+
+    def _dependency(self, combo, origin):
+        # The combination sums to zero, so one of its linear combinations is
+        # spanned by the others and no longer contributes to the basis
+        if origin is None or self._coef(combo, self.lc_cols[origin]) == 0:
+            origin = self.col_keys[self._low_col(combo)]
+        col = self.lc_cols.pop(origin)
+        inv = FF_INV[self._coef(combo, col)]
+        for q, qrow in self.rows.items():
+            c = self._coef(qrow, col)
+            if c:
+                self.rows[q] = qrow ^ self._mul(combo, FF_MUL[c][inv])
+        self._free_col(col)
+
+        return origin
+
+    def _downdate(self, lc_pid):
+        col = self.lc_cols.pop(lc_pid)
+        rows = [q for q, qrow in self.rows.items() if self._coef(qrow, col)]
+
+        # Eliminate the expired linear combination from all but one basis
+        # row, then drop that row
+        if len(rows) > 0:
+            self.generation += 1
+            row0 = self.rows.pop(rows[0])
+            inv = FF_INV[self._coef(row0, col)]
+            for q in rows[1:]:
+                qrow = self.rows[q]
+                self.rows[q] = qrow ^ self._mul(row0, FF_MUL[self._coef(qrow, col)][inv])
+
+            # Redundant linear combinations may now be needed to span the basis
+            self.refold = True
+
+        self._free_col(col)
+
+    def _project(self, pid):
+        self.decoded[pid] = self.msg_refs.get(pid, 0)
+
+        if pid not in self.msg_cols:
+            return
+
+        self.generation += 1
+        col = self.msg_cols[pid]
+        mask = ~(0xff << (8*col))
+
+        # Drop the decoded column from the non-pivot entries
+        for q, qrow in self.rows.items():
+            if q != col and self._coef(qrow, col):
+                self.rows[q] = qrow & mask
+
+        # Re-fold the row that had its pivot at the decoded column
+        row = self.rows.pop(col, None)
+
+        del self.msg_refs[pid]
+        self._free_msg_col(pid)
+
+        if row is not None:
+            row &= mask
+            origin = self._fold(row, None)
+            # The dropped linear combination joins the redundant ones
+            if origin is not None:
+                self.redundant[origin] = self.live[origin]
+
+    def forget(self, pids, decoded_pids):
+        # Forgotten messages are undecoded again. Their columns were projected
+        # out of the live linear combinations referencing them, so rebuild
+        # the basis from the live linear combinations if there are any, over
+        # the "decoded_pids" still remembered.
+        rebuild = False
+        for pid in pids:
+            if pid in self.decoded and self.decoded.pop(pid) > 0:
+                rebuild = True
+        if not rebuild:
+            return
+
+        live = self.live
+        self.__init__()
+        for pid in decoded_pids:
+            self.decoded[pid] = 0
+        for lc_pid, (pids, coefs) in live.items():
+            self.add(lc_pid, pids, coefs)
+
+    #########################
+
+    def solve(self, decoded_pids):
+        # Project out newly decoded columns
+        for pid in decoded_pids:
+            if pid not in self.decoded:
+                self._project(pid)
+
+        # Re-fold redundant linear combinations after a basis row was dropped
+        if self.refold:
+            self.pending.update(self.redundant)
+            self.redundant = {}
+            self.refold = False
+
+        # Fold in newly received linear combinations
+        for lc_pid, (pids, coefs) in self.pending.items():
+            row = 0
+            for pid, c in dict(zip(pids, coefs)).items():
+                if pid in self.msg_cols:
+                    row |= c << (8*self.msg_cols[pid])
+            if row == 0:
+                continue
+
+            col = self._alloc_col(lc_pid)
+            self.lc_cols[lc_pid] = col
+            row |= 1 << (8*col)
+
+            if self._fold(row, lc_pid) is not None:
+                self.redundant[lc_pid] = self.live[lc_pid]
+        self.pending = {}
+
+        # The basis is unchanged since the last scan
+        self.skipped = self.generation == self.solved_generation
+        if self.skipped:
+            return set(self.solved)
+
+        # Solved columns have a unit row in the reduced basis
+        solved = set()
+        for p, row in self.rows.items():
+            if row & self.msg_mask == 1 << (8*p):
+                solved.add(self.col_keys[p])
+
+        self.solved = solved
+        self.solved_generation = self.generation
+
+        return set(solved)
+
+class Window_Slots():
+    # Pids and coefficients of the live linear combinations of a Gossip
+    # Window in NumPy arrays, a row per slot in the order they were added
+    def __init__(self):
+        self.pids = numpy.zeros((64, 0), dtype=numpy.int64)
+        self.coefs = numpy.zeros((64, 0), dtype=numpy.uint8)
+        self.nnz = numpy.zeros(64, dtype=numpy.int32)
+        self.live = numpy.zeros(64, dtype=bool)
+        self.objects = [None]*64
+        # Slot of each live pid, and the number of slots used
+        self.slot = {}
+        self.count = 0
+
+    def add(self, lc):
+        if self.count == len(self.live):
+            self.compact()
+        if len(lc.coefs) > self.pids.shape[1]:
+            self.resize(len(self.live), len(lc.coefs))
+
+        i = self.count
+        self.pids[i, :len(lc.coefs)] = [m.pid for m in lc.messages]
+        self.coefs[i, :len(lc.coefs)] = numpy.frombuffer(lc.coefs, dtype=numpy.uint8)
+        self.nnz[i] = len(lc.coefs)
+        self.live[i] = True
+        self.objects[i] = lc
+        self.slot[lc.pid] = i
+        self.count += 1
+
+    def remove(self, pid):
+        i = self.slot.pop(pid)
+        self.live[i] = False
+        self.objects[i] = None
+
+    def resize(self, num_slots, width):
+        for name in ('pids', 'coefs'):
+            old = getattr(self, name)
+            new = numpy.zeros((num_slots, width), dtype=old.dtype)
+            new[:old.shape[0], :old.shape[1]] = old
+            setattr(self, name, new)
+        self.nnz = numpy.concatenate((self.nnz, numpy.zeros(num_slots - len(self.nnz), dtype=numpy.int32)))
+        self.live = numpy.concatenate((self.live, numpy.zeros(num_slots - len(self.live), dtype=bool)))
+        self.objects += [None]*(num_slots - len(self.objects))
+
+    def compact(self):
+        # Move the live rows to the front, keeping their order, and grow when
+        # more than half the slots are live
+        rows = numpy.flatnonzero(self.live[:self.count])
+        n = len(rows)
+        self.pids[:n] = self.pids[rows]
+        self.coefs[:n] = self.coefs[rows]
+        self.nnz[:n] = self.nnz[rows]
+        self.live[:n] = True
+        self.live[n:] = False
+        self.objects[:self.count] = [self.objects[i] for i in rows] + [None]*(self.count - n)
+        for i in range(n):
+            self.slot[self.objects[i].pid] = i
+        self.count = n
+
+        if 2*n > len(self.live):
+            self.resize(2*len(self.live), self.pids.shape[1])
 
+class Gossip_Window():
+    def __init__(self, solver="matrix", tracked=(), profile=None):
+        # Live objects by pid, in the order they were added
+        self.window_live = {}
+        # Live objects by source and pid, and the source of each live object
         self.window_live_by_source = {}
+        self.source = {}
+        # Pids of tracked messages, live objects -> number of tracked messages
+        # they combine, and the total over our window
+        self.tracked = tracked
+        self.window_tracked = {}
+        self.tracked_refs = 0
+
+        # Timing wheel of the live pids
+        self.wheel = Timing_Wheel()
+
+        # Incremental decoder, or None to rebuild the matrix every solve
+        self.decoder = Incremental_Decoder() if solver == "incremental" else None
+        # Rows of live objects in arrays, for building matrices with NumPy
+        self.slots = Window_Slots() if self.decoder is None and numpy is not None else None
+
+        # Change tracking for the matrix solver, to skip solves that cannot
+        # solve anything new: message pid -> number of live objects combining
+        # it, the objects added since the last solve, the pids combined at the
+        # last solve and no longer, and the reverse, and the Decoded Window
+        # generation, messages solved and number of undecoded columns at the
+        # last solve
+        self.msg_refs = {}
+        self.added = []
+        self.unreferenced = set()
+        self.referenced = set()
+        self.decoded_generation = None
+        self.solved_pids = set()
+        self.num_undecoded = 0
+        # Whether the last solve was skipped
+        self.skipped = False
+
+        # Stats profile to charge the matrix build and solve to, if any
+        self.profile = profile
 
     def add(self, src, p, ttl):
-        if p in self.window_live:
+        if p.pid in self.window_live:
             return False
 
         # Add it to our live window
-        self.window_live.append(p)
-        self.ttl[p.pid] = ttl
+        self.window_live[p.pid] = p
+        self.wheel.add(p.pid, ttl)
 
-        # Create a new list for the source if it's not in our dictionary
+        # Create a new dictionary for the source if it's not in our dictionary
         if src not in self.window_live_by_source:
-            self.window_live_by_source[src] = []
-
-        # Add the message to the source's list
-        self.window_live_by_source[src].append(p)
+            self.window_live_by_source[src] = {}
+
+        # Add the message to the source's dictionary
+        self.window_live_by_source[src][p.pid] = p
+        self.source[p.pid] = src
+
+        # Count the tracked messages it combines
+        refs = sum(1 for m in p.messages if m.pid in self.tracked)
+        if refs > 0:
+            self.window_tracked[p.pid] = refs
+            self.tracked_refs += refs
+
+        if self.decoder is not None:
+            self.decoder.add(p.pid, [m.pid for m in p.messages], p.coefs)
+        else:
+            self.added.append(p)
+            for m in p.messages:
+                if m.pid not in self.msg_refs:
+                    self.msg_refs[m.pid] = 0
+                    if m.pid in self.unreferenced:
+                        self.unreferenced.remove(m.pid)
+                    else:
+                        self.referenced.add(m.pid)
+                self.msg_refs[m.pid] += 1
+            if self.slots is not None:
+                self.slots.add(p)
 
         return True
 
-    def tick(self):
-        # For each source
-        for src in self.window_live_by_source:
-            # For each live object
-            for p in self.window_live_by_source[src]:
-                # Decrement the TTL
-                self.ttl[p.pid] -= 1
-                # Delete the object if it expires
-                if self.ttl[p.pid] <= 0:
-                    del self.ttl[p.pid]
-                    self.window_live_by_source[src].remove(p)
-                    self.window_live.remove(p)
+    def ttl(self, p):
+        return self.wheel.ttl(p.pid)
+
+    def expire(self, p):
+        del self.window_live[p.pid]
+        del self.window_live_by_source[self.source.pop(p.pid)][p.pid]
+        self.tracked_refs -= self.window_tracked.pop(p.pid, 0)
+
+        if self.decoder is not None:
+            self.decoder.remove(p.pid)
+        else:
+            for m in p.messages:
+                self.msg_refs[m.pid] -= 1
+                if self.msg_refs[m.pid] == 0:
+                    del self.msg_refs[m.pid]
+                    if m.pid in self.referenced:
+                        self.referenced.remove(m.pid)
+                    else:
+                        self.unreferenced.add(m.pid)
+            if self.slots is not None:
+                self.slots.remove(p.pid)
 
+    def tick(self):
+        # Delete the objects whose TTL ran out
+        for pid in self.wheel.tick():
+            self.expire(self.window_live[pid])
 
     def choose_random_uniform(self):
         # Choose a random source
         src = random.choice(list(self.window_live_by_source.keys()))
 
         # Gather a list of objects by this source
-        choices = self.window_live_by_source[src]
+        choices = list(self.window_live_by_source[src].values())
 
         return random.choice(choices)
 
-    def choose_random(self):
+    def choose_random(self, rng=random):
         # Choose a random source
-        src = random.choice(list(self.window_live_by_source.keys()))
+        src = rng.choice(list(self.window_live_by_source.keys()))
 
-        # Sort live objects by TTL
-        choices, scores = [list(t) for t in zip(*sorted([(m, self.ttl[m.pid]) for m in self.live_objects()], key=operator.itemgetter(1)))]
+        # Choose a weighted random choice by TTL, from the live pids in order
+        # of TTL and then of addition
+        (scores, buckets) = self.wheel.scored_buckets()
 
-        return choices[choose_weighted_random(scores)]
+        return self.window_live[choose_weighted_buckets(scores, buckets, 1, rng)[0]]
 
     def live_objects(self):
-        return self.window_live[:]
+        return list(self.window_live.values())
 
     def objects(self):
-        return self.window_live[:]
+        return list(self.window_live.values())
+
+    def num_objects(self):
+        return len(self.window_live)
+
+    def num_tracked(self):
+        return self.tracked_refs
 
     def __str__(self):
         s = "Gossip Window\n"
-        for x in self.window_live:
-            s += "\t" + str(x) + " TTL: " + str(self.ttl[x.pid]) + "\n"
+        for x in self.live_objects():
+            s += "\t" + str(x) + " TTL: " + str(self.ttl(x)) + "\n"
         return s
 
     def solve(self, decoded_window):
-        # Map of column index -> message
-        col_map = {}
-        # Map of pid -> column index
-        pid_map = {}
+        if self.decoder is None:
+            return self.solve_matrix(decoded_window)
+
+        # Forget decoded messages the Decoded Window no longer remembers
+        if len(decoded_window.forgotten) > 0:
+            self.decoder.forget(decoded_window.forgotten, \
+                                itertools.chain(decoded_window.window_live, decoded_window.window_expired))
+            decoded_window.forgotten = []
+
+        # Messages are decoded with a TTL of more than one round, so all those
+        # decoded since the last solve are still live
+        solved_pids = self.decoder.solve(decoded_window.window_live)
+        self.skipped = self.decoder.skipped
+        # Folding into the decoder is charged to the solve
+        if self.profile is not None:
+            self.profile.lap("solve")
+
+        # Dimensions of the matrix the matrix solver would build
+        num_rows = decoded_window.num_objects() + len(self.window_live)
+        num_cols = decoded_window.num_objects() + len(self.decoder.msg_refs)
+
+        # Gather newly solved messages in matrix column order
+        solved = []
+        for lc in (self.live_objects() if len(solved_pids) > 0 else []):
+            if len(solved_pids) == 0:
+                break
+            for m in lc.messages:
+                if m.pid in solved_pids:
+                    solved_pids.remove(m.pid)
+                    solved.append(m)
+        if self.profile is not None:
+            self.profile.lap("build")
 
-        num_cols = 0
+        return (num_rows, num_cols, solved)
 
-        decoded = decoded_window.objects()
-        # Gather unique columns from decoded messages
-        for m in decoded:
-            col_map[num_cols] = m
-            pid_map[m.pid] = num_cols
-            num_cols += 1
-        num_rows = len(decoded)
-        num_decoded = num_cols
+    def matrix_rows(self, decoded_window, batch):
+        # Add our matrix to a batch, returning a lookup of the message of each
+        # column after the decoded columns
+        if self.slots is not None and len(self.window_live) >= MATRIX_NUMPY_MIN_ROWS:
+            return self.matrix_rows_numpy(decoded_window, batch)
 
         undecoded_lc = self.live_objects()
-        # Gather unique columns from linear combinations
-        for lc in undecoded_lc:
-            for m in lc.messages:
-                if m.pid not in pid_map:
-                    col_map[num_cols] = m
-                    pid_map[m.pid] = num_cols
-                    num_cols += 1
-        num_rows += len(undecoded_lc)
 
-        # Clear matrix and solved indices
-        cff.matrix_util_clear(SolvedIndices, Matrix, num_rows, num_cols)
+        # Gather unique columns from decoded messages
+        col_map = decoded_window.objects()
+        num_decoded = len(col_map)
 
-        row = 0
-        # Build decoded rows (... 0, 0, 1, 0, 0 ... )
-        for m in decoded:
-            Matrix[num_cols*row + pid_map[m.pid]] = 1
-            row += 1
+        pid_map = dict((m.pid, i) for (i, m) in enumerate(col_map))
 
-        # Build linear combined rows ( ..., a, b, c, d, ... )
+        # Decoded rows (... 0, 0, 1, 0, 0 ... ) form the identity over the
+        # first num_decoded columns, which the sparse solver pre-eliminates
+        # without reading them. Build linear combined rows ( ..., a, b, c,
+        # d, ... ), gathering unique columns from linear combinations.
         for lc in undecoded_lc:
-            for i in range(len(lc.coefs)):
-                Matrix[num_cols*row + pid_map[lc.messages[i].pid]] = lc.coefs[i]
-            row += 1
+            for m in lc.messages:
+                if m.pid not in pid_map:
+                    pid_map[m.pid] = len(col_map)
+                    col_map.append(m)
+                batch.cols.append(pid_map[m.pid])
+            batch.row_nnz.append(len(lc.coefs))
+            batch.coefs += lc.coefs
+
+        batch.dims.extend((num_decoded + len(undecoded_lc), len(col_map), num_decoded))
+
+        return col_map.__getitem__
+
+    def matrix_rows_numpy(self, decoded_window, batch):
+        # Build the linear combined rows like matrix_rows(), from the rows of
+        # our slots, mapping pids to columns with array operations instead of
+        # a dictionary per entry
+        num_decoded = decoded_window.num_live_objects() + len(decoded_window.window_expired)
+        decoded_pids = numpy.fromiter(itertools.chain(decoded_window.window_live, decoded_window.window_expired), \
+                                      dtype=numpy.int64, count=num_decoded)
+
+        # Entries of the live rows, one row after another
+        slots = self.slots
+        rows = numpy.flatnonzero(slots.live[:slots.count])
+        row_nnz = slots.nnz[rows]
+        entry_mask = numpy.arange(slots.pids.shape[1]) < row_nnz[:, None]
+        pids = slots.pids[rows][entry_mask]
+
+        # Number columns by the first appearance of their pid over the decoded
+        # pids followed by the entries, so decoded messages map to their
+        # identity column and undecoded messages get new columns in order
+        (_, first, inverse) = numpy.unique(numpy.concatenate((decoded_pids, pids)), \
+                                           return_index=True, return_inverse=True)
+        appears = numpy.zeros(num_decoded + len(pids), dtype=bool)
+        appears[first] = True
+        rank = numpy.cumsum(appears, dtype=numpy.int64) - 1
+        cols = rank[first][inverse.reshape(-1)[num_decoded:]].astype(numpy.uint32)
+        num_cols = len(first)
+
+        batch.cols.frombytes(cols.tobytes())
+        batch.row_nnz.frombytes(row_nnz.tobytes())
+        batch.coefs += slots.coefs[rows][entry_mask].tobytes()
+        batch.dims.extend((num_decoded + len(rows), num_cols, num_decoded))
+
+        # Look up the message of a new column by the row and position of its
+        # first entry
+        starts = numpy.cumsum(row_nnz) - row_nnz
+        entries = numpy.flatnonzero(appears[num_decoded:])
+        def col_message(col):
+            entry = int(entries[col - num_decoded])
+            row = int(numpy.searchsorted(starts, entry, side='right')) - 1
+            return slots.objects[rows[row]].messages[entry - int(starts[row])]
+
+        return col_message
+
+    def unchanged(self, decoded_window):
+        # Whether our matrix solves nothing new since the last solve: the
+        # objects added since only combine decoded messages, and the Decoded
+        # Window forgot nothing, added the messages we solved, and otherwise
+        # only added messages none of our objects combine
+        if self.decoded_generation is None or decoded_window.added is None:
+            return False
+        if decoded_window.generation - self.decoded_generation != len(decoded_window.added):
+            return False
 
-        # rref matrix
-        num_solved = cff.matrix_solve(SolvedIndices, Matrix, num_rows, num_cols)
+        decoded_live = decoded_window.window_live
+        decoded_expired = decoded_window.window_expired
+        for lc in self.added:
+            if lc.pid not in self.window_live:
+                continue
+            for m in lc.messages:
+                if m.pid not in decoded_live and m.pid not in decoded_expired:
+                    return False
 
-        # Gather newly solved messages
-        solved = []
-        for i in range(num_solved):
-            if SolvedIndices[i] >= num_decoded:
-                m = col_map[SolvedIndices[i]]
-                solved.append(m)
+        for pid in self.solved_pids:
+            if pid not in decoded_live and pid not in decoded_expired:
+                return False
+        for pid in decoded_window.added:
+            if pid not in self.solved_pids and pid in self.msg_refs:
+                return False
 
-        return (num_rows, num_cols, solved)
+        return True
+
+    def track_solve(self, decoded_window, num_cols, solved):
+        # Start tracking changes from this solve
+        num_decoded = len(decoded_window.window_live) + len(decoded_window.window_expired)
+        self.added = []
+        self.unreferenced = set()
+        self.referenced = set()
+        self.decoded_generation = decoded_window.generation
+        self.solved_pids = set(m.pid for m in solved)
+        self.num_undecoded = num_cols - num_decoded
+        decoded_window.added = []
+        # Forgotten messages are undecoded columns in our next matrix
+        decoded_window.forgotten = []
+
+    def solve_matrix(self, decoded_window):
+        self.skipped = self.unchanged(decoded_window)
+        if self.skipped:
+            # The solved messages moved to the decoded columns, and the
+            # messages undecoded at the last solve and no longer combined
+            # dropped out. Messages decoded since were undecoded then.
+            num_decoded = len(decoded_window.window_live) + len(decoded_window.window_expired)
+            added = set(decoded_window.added)
+            num_undecoded = self.num_undecoded - len(self.solved_pids) - \
+                            sum(1 for pid in self.unreferenced if pid not in self.solved_pids and \
+                                (pid in added or (pid not in decoded_window.window_live and \
+                                                  pid not in decoded_window.window_expired)))
+            self.track_solve(decoded_window, num_decoded + num_undecoded, [])
+            if self.profile is not None:
+                self.profile.lap("solve")
+            return (num_decoded + len(self.window_live), num_decoded + num_undecoded, [])
+
+        batch = Matrix_Batch()
+        col_message = self.matrix_rows(decoded_window, batch)
+        if self.profile is not None:
+            self.profile.lap("build")
 
+        # rref matrix
+        solved_indices = matrix_context().solve_batch(batch)[0]
+        if self.profile is not None:
+            self.profile.lap("solve")
+
+        # Gather newly solved messages, which follow the decoded columns
+        solved = [col_message(i) for i in solved_indices]
+        self.track_solve(decoded_window, batch.dims[1], solved)
+
+        return (batch.dims[0], batch.dims[1], solved)
+
+def solve_gossip_windows(windows):
+    # Solve the matrices of (Gossip Window, Decoded Window) pairs with one
+    # call into the solver, for windows whose solves do not depend on each
+    # other's decodes. Returns the (rows, columns, solved messages) of each.
+    batch = Matrix_Batch()
+    col_messages = [gossip_window.matrix_rows(decoded_window, batch) for (gossip_window, decoded_window) in windows]
+
+    results = []
+    for (i, solved_indices) in enumerate(matrix_context().solve_batch(batch)):
+        (gossip_window, decoded_window) = windows[i]
+        solved = [col_messages[i](j) for j in solved_indices]
+        gossip_window.skipped = False
+        gossip_window.track_solve(decoded_window, batch.dims[3*i + 1], solved)
+        results.append((batch.dims[3*i], batch.dims[3*i + 1], solved))
+
+    return results
@@ -0,0 +1,142 @@
+# Regression checks of the window sampling and matrix building fast paths
+# against the simpler code they replace, on fixed seeds.
+#
+# Run from the directory of ff.so with: python3 -m pytest tests/
+
+import operator
+import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import window
+from window import *
+from message import *
+
+def sorted_choose_random(objects, ttls, n):
+    # Weighted choices without replacement over the objects sorted by TTL, as
+    # the windows chose before sampling by TTL bucket
+    choices, scores = [list(t) for t in zip(*sorted(zip(objects, ttls), key=operator.itemgetter(1)))]
+    chosen = []
+    for _ in range(min(n, len(choices))):
+        k = choose_weighted_random(scores)
+        chosen.append(choices[k])
+        del choices[k]
+        del scores[k]
+    return chosen
+
+def test_decoded_choose_random():
+    for seed in range(20):
+        rng = random.Random(seed)
+        decoded = Decoded_Window()
+        for i in range(rng.randint(1, 60)):
+            decoded.add(RealMessage(0, rng), rng.randint(1, 30))
+            if rng.random() < 0.3:
+                decoded.tick()
+
+        objects = decoded.live_objects()
+        ttls = [decoded.ttl(m) for m in objects]
+        for n in [1, 4, 10]:
+            random.seed(seed)
+            expected = sorted_choose_random(objects, ttls, n)
+            random.seed(seed)
+            assert decoded.choose_random(n) == expected
+
+def test_gossip_choose_random():
+    for seed in range(20):
+        rng = random.Random(seed)
+        gossip = Gossip_Window()
+        for i in range(rng.randint(1, 60)):
+            gossip.add(rng.randint(0, 4), RLC([RealMessage(0, rng) for _ in range(4)], rng), rng.randint(1, 10))
+            if rng.random() < 0.3:
+                gossip.tick()
+
+        objects = gossip.live_objects()
+        ttls = [gossip.ttl(lc) for lc in objects]
+        random.seed(seed)
+        random.choice(list(gossip.window_live_by_source.keys()))
+        expected = sorted_choose_random(objects, ttls, 1)[0]
+        random.seed(seed)
+        assert gossip.choose_random() is expected
+
+def gossip_windows(rng, numDecoded, numLC, numUndecoded):
+    # Decoded Window with live and expired messages, and a matrix solver
+    # Gossip Window of linear combinations over them and undecoded messages,
+    # some of them expired
+    decoded = Decoded_Window()
+    for i in range(numDecoded):
+        decoded.add(RealMessage(0, rng), 1 + i % 3)
+    decoded.tick()
+
+    pool = decoded.objects() + [RealMessage(1, rng) for _ in range(numUndecoded)]
+    gossip = Gossip_Window("matrix")
+    for i in range(numLC):
+        gossip.add(i % 16, RLC(rng.sample(pool, rng.randint(1, 6)), rng), rng.randint(1, 10))
+        if i % 8 == 7:
+            gossip.tick()
+
+    return (decoded, gossip)
+
+def test_matrix_rows_numpy():
+    if window.numpy is None:
+        return
+
+    minRows = window.MATRIX_NUMPY_MIN_ROWS
+    try:
+        for (seed, size) in enumerate([(4, 10, 8), (30, 100, 60), (60, 400, 300)]):
+            (decoded, gossip) = gossip_windows(random.Random(seed), *size)
+            assert len(decoded.window_expired) > 0
+            assert len(gossip.live_objects()) < gossip.slots.count
+
+            # Build the matrix from the slot arrays and from the dictionary
+            batches = []
+            for window.MATRIX_NUMPY_MIN_ROWS in [0, float('inf')]:
+                batch = Matrix_Batch()
+                col_message = gossip.matrix_rows(decoded, batch)
+                batches.append((batch, col_message))
+
+            ((b1, c1), (b2, c2)) = batches
+            assert b1.dims == b2.dims
+            assert b1.cols == b2.cols
+            assert b1.row_nnz == b2.row_nnz
+            assert b1.coefs == b2.coefs
+            (_, num_cols, num_decoded) = b1.dims
+            assert all(c1(i) is c2(i) for i in range(num_decoded, num_cols))
+            assert matrix_context().solve_batch(b1) == matrix_context().solve_batch(b2)
+    finally:
+        window.MATRIX_NUMPY_MIN_ROWS = minRows
+
+def test_skipped_solve_dims():
+    # Rows and columns reported by skipped solves against the matrix a full
+    # solve would build, with decoded messages kept forever and forgotten
+    skips = 0
+    for expired_ttl in [None, 3]:
+        for seed in range(60):
+            rng = random.Random(seed)
+            decoded = Decoded_Window() if expired_ttl is None else Decoded_Window(expired_ttl)
+            gossip = Gossip_Window("matrix")
+            pool = [RealMessage(0, rng) for _ in range(12)]
+            for step in range(30):
+                for _ in range(rng.randint(0, 2)):
+                    gossip.add(rng.randint(0, 3), RLC(rng.sample(pool, 3), rng), rng.randint(1, 4))
+                gossip.tick()
+                decoded.tick()
+                for _ in range(rng.randint(0, 1)):
+                    decoded.add(rng.choice(pool), rng.randint(1, 5) if expired_ttl else 50)
+
+                (num_rows, num_cols, solved) = gossip.solve(decoded)
+                batch = Matrix_Batch()
+                gossip.matrix_rows(decoded, batch)
+                assert (num_rows, num_cols) == tuple(batch.dims[:2])
+                skips += gossip.skipped
+
+                for m in solved:
+                    decoded.add(m, rng.randint(2, 5) if expired_ttl else 50)
+
+    assert skips > 0
+
+if __name__ == "__main__":
+    for (name, test) in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print("%s passed" % name)